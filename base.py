@@ -1,20 +1,35 @@
-from agno.agent import Agent as AgnoAgent
-from agno.models.openai import OpenAIChat
-from typing import List, Dict, Optional
-from agno.memory.v2.db.sqlite import SqliteMemoryDb
-from agno.memory.v2.memory import Memory
-import uuid
+from functools import lru_cache
+from typing import TYPE_CHECKING, List, Dict, FrozenSet, Optional, Tuple, Union
+import os
+import itertools
+import threading
+import time
 from dotenv import load_dotenv
 load_dotenv()
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Table, Text, DateTime, Float
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship, joinedload
+from sqlalchemy import cast, delete, event, exists, func, insert, literal, select, tuple_, update, Column, Index, Integer, String, ForeignKey, Table, Text, DateTime, Float
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, selectinload
 import datetime
-from agno.agent import Agent as AgnoAgent
-from agno.models.openai import OpenAIChat
-from agno.team.team import Team
+from cache import TTLCache
+from catalog import Catalog
+from db import create_sqlite_engine, ensure_indexes, upsert, writer
+from inventory import ReservationCounter, ReservationSweeper
+from router import KeywordRouter, RouteDecision
+from recommend import Recommender
+from search_index import ProductSearchIndex
+from slots import MemoryDbSlotStore, SlotCache
+from prompt_layout import render_context, render_memories, split_instructions, with_context
+from tool_gating import ToolGate
 from agno.tools import tool
 
+# Agents, the team and the memory store pull in the OpenAI client stack; they are only
+# imported by the get_*() factories below, so tool-only workers and tests never load them.
+if TYPE_CHECKING:
+    from agno.agent import Agent as AgnoAgent
+    from agno.memory.v2.memory import Memory
+    from agno.team.team import Team
+
 # --- Dummy Data ---
 PRODUCTS = [
     {"id": "p1", "name": "Classic Blue Jeans", "brand": "Levi's", "color": "blue", "style": "casual", "price": 89.99, "stock": 10},
@@ -24,10 +39,16 @@ PRODUCTS = [
     {"id": "p5", "name": "White Sneakers", "brand": "Adidas", "color": "white", "style": "sporty", "price": 89.99, "stock": 6},
 ]
 
+# Set CATALOG_PATH to a .jsonl/.csv/.parquet file to serve a real catalog; it is loaded on first use.
+catalog = Catalog(PRODUCTS, path=os.getenv("CATALOG_PATH"))
+
 # --- SQLAlchemy Setup ---
 Base = declarative_base()
-engine = create_engine('sqlite:///shopping.db')
+engine = create_sqlite_engine()
 SessionLocal = sessionmaker(bind=engine)
+# Sessions that write begin IMMEDIATE; reads stay DEFERRED so they never take the write lock.
+write_engine = writer(engine)
+WriteSessionLocal = sessionmaker(bind=write_engine)
 
 # --- Models ---
 class User(Base):
@@ -46,6 +67,7 @@ class User(Base):
 
 class Address(Base):
     __tablename__ = 'addresses'
+    __table_args__ = (Index('ux_addresses_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     address = Column(Text)
@@ -53,6 +75,7 @@ class Address(Base):
 
 class Size(Base):
     __tablename__ = 'sizes'
+    __table_args__ = (Index('ux_sizes_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     size = Column(String)
@@ -60,6 +83,7 @@ class Size(Base):
 
 class Payment(Base):
     __tablename__ = 'payments'
+    __table_args__ = (Index('ux_payments_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     method = Column(String)
@@ -67,6 +91,7 @@ class Payment(Base):
 
 class Preference(Base):
     __tablename__ = 'preferences'
+    __table_args__ = (Index('ux_preferences_user_id_key', 'user_id', 'key', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     key = Column(String)
@@ -75,6 +100,7 @@ class Preference(Base):
 
 class Travel(Base):
     __tablename__ = 'travels'
+    __table_args__ = (Index('ux_travels_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     status = Column(String)
@@ -84,12 +110,13 @@ class Travel(Base):
 class Birthday(Base):
     __tablename__ = 'birthdays'
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     birthday = Column(String)  # YYYY-MM-DD
     user = relationship('User', back_populates='birthdays')
 
 class Cart(Base):
     __tablename__ = 'carts'
+    __table_args__ = (Index('ix_carts_user_id_product_id', 'user_id', 'product_id'),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     product_id = Column(String)
@@ -98,6 +125,7 @@ class Cart(Base):
 
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (Index('ix_orders_user_id_created_at_id', 'user_id', 'created_at', 'id'),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     address = Column(Text)
@@ -108,215 +136,546 @@ class Order(Base):
 
 class OrderItem(Base):
     __tablename__ = 'order_items'
+    __table_args__ = (Index('ix_order_items_product_id_order_id', 'product_id', 'order_id'),)
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey('orders.id'))
+    order_id = Column(Integer, ForeignKey('orders.id'), index=True)
     product_id = Column(String)
     quantity = Column(Integer)
     order = relationship('Order', back_populates='items')
 
-# Create tables
-Base.metadata.create_all(engine)
+class Inventory(Base):
+    __tablename__ = 'inventory'
+    product_id = Column(String, primary_key=True)
+    stock = Column(Integer, nullable=False, default=0)
+
+class Reservation(Base):
+    __tablename__ = 'reservations'
+    __table_args__ = (Index('ix_reservations_product_id_expires_at', 'product_id', 'expires_at'),)
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+    product_id = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+_db_ready = False
+
+def init_db() -> None:
+    # Create tables, then add any indexes missing from databases created before they existed.
+    # Explicit (and idempotent) so importing this module never touches the database.
+    global _db_ready
+    if not _db_ready:
+        Base.metadata.create_all(engine)
+        ensure_indexes(engine, Base.metadata)
+        _db_ready = True
+
+# --- Inventory ---
+# Persistent stock, seeded from the catalog the first time it is needed and again for any
+# product a refreshed catalog adds. Existing rows are left alone so stock already sold by
+# any worker is never reset; the catalog's in-memory stock is reloaded from these rows.
+# To apply a new stock count, call restock_from_catalog(), which overwrites existing rows.
+_inventory_version: Optional[int] = None
+_inventory_lock = threading.Lock()
+
+def _write_inventory(statement, batch_size: int) -> None:
+    rows = ({"product_id": p["id"], "stock": p["stock"]} for p in catalog)
+    with write_engine.begin() as conn:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            conn.execute(statement, batch)
+    # A refresh reloads stock from the catalog file, so pull the sold-down rows back in.
+    release_expired_reservations()
+
+def ensure_inventory(batch_size: int = 10000) -> None:
+    global _inventory_version
+    if _inventory_version == catalog.version:
+        return
+    with _inventory_lock:
+        if _inventory_version == catalog.version:
+            return
+        version = catalog.version
+        _write_inventory(sqlite_insert(Inventory).on_conflict_do_nothing(index_elements=["product_id"]), batch_size)
+        _inventory_version = version
+    reservation_sweeper.start()
+
+def restock_from_catalog(products: Optional[List[dict]] = None, batch_size: int = 10000) -> None:
+    """Refresh the catalog (from `products` or CATALOG_PATH) and make its stock authoritative.
+
+    Every Inventory row is overwritten with the catalog's count, so units sold since that
+    count was taken are forgotten; live cart holds still count against the new stock.
+    """
+    global _inventory_version
+    catalog.refresh(products)
+    with _inventory_lock:
+        version = catalog.version
+        statement = sqlite_insert(Inventory)
+        _write_inventory(
+            statement.on_conflict_do_update(index_elements=["product_id"], set_={"stock": statement.excluded.stock}),
+            batch_size,
+        )
+        _inventory_version = version
+    reservation_sweeper.start()
+
+def _load_inventory_stock(conn) -> None:
+    for row in conn.execute(select(Inventory.product_id, Inventory.stock)):
+        catalog.set_stock(row.product_id, row.stock)
+
+# --- Stock Reservations ---
+# add_to_cart places a hold that expires after RESERVATION_TTL_SECONDS; checkout turns the
+# user's holds into sales. Expired holds stop counting immediately (every availability
+# check filters on expires_at); the sweeper just deletes them in batches and resyncs the
+# in-memory totals and stock that check_stock reads, picking up other workers' sales.
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+reservation_counter = ReservationCounter()
+
+def _reserved_by_others(product_id: str, now: datetime.datetime, user_pk: Optional[int] = None):
+    query = select(func.coalesce(func.sum(Reservation.quantity), 0)).where(
+        Reservation.product_id == product_id, Reservation.expires_at > now
+    )
+    if user_pk is not None:
+        query = query.where(Reservation.user_id != user_pk)
+    return query.scalar_subquery()
+
+def release_expired_reservations(batch_size: int = 1000) -> int:
+    now = datetime.datetime.utcnow()
+    released = 0
+    while True:
+        with write_engine.begin() as conn:
+            ids = conn.execute(
+                select(Reservation.id).where(Reservation.expires_at <= now).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(delete(Reservation).where(Reservation.id.in_(ids)))
+        released += len(ids)
+    with engine.connect() as conn:
+        _load_inventory_stock(conn)
+        totals = conn.execute(
+            select(Reservation.product_id, func.sum(Reservation.quantity))
+            .where(Reservation.expires_at > now)
+            .group_by(Reservation.product_id)
+        ).all()
+    reservation_counter.replace(dict(totals))
+    return released
+
+reservation_sweeper = ReservationSweeper(
+    release_expired_reservations,
+    interval=float(os.getenv("RESERVATION_SWEEP_INTERVAL_SECONDS", "30")),
+)
+
+def available_stock(product_id: str) -> int:
+    return max(0, catalog.stock(product_id) - reservation_counter.reserved(product_id))
+
+# --- User Profile Cache ---
+# A concierge turn typically reads several profile fields for the same user; serve them
+# all from one snapshot and drop the snapshot whenever a tool writes to that profile.
+profile_cache = TTLCache(
+    maxsize=int(os.getenv("PROFILE_CACHE_MAX_USERS", "10000")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "300")),
+)
+
+PROFILE_RELATIONSHIPS = (User.addresses, User.sizes, User.payments, User.preferences, User.travels, User.birthdays)
+
+def _snapshot_profile(user: Optional[User]) -> dict:
+    profile = {"address": None, "size": None, "payment": None, "preferences": {}, "travel": None, "birthday": None}
+    if user:
+        profile["address"] = user.addresses[0].address if user.addresses else None
+        profile["size"] = user.sizes[0].size if user.sizes else None
+        profile["payment"] = user.payments[0].method if user.payments else None
+        for pref in user.preferences:
+            profile["preferences"].setdefault(pref.key, pref.value)
+        if user.travels:
+            profile["travel"] = {"status": user.travels[0].status, "location": user.travels[0].location}
+        profile["birthday"] = user.birthdays[0].birthday if user.birthdays else None
+    return profile
+
+def _load_profile(user_id: str) -> dict:
+    session = SessionLocal()
+    user = session.query(User).options(
+        *(selectinload(rel) for rel in PROFILE_RELATIONSHIPS)
+    ).filter_by(email=user_id).first()
+    profile = _snapshot_profile(user)
+    session.close()
+    return profile
+
+def get_profile(user_id: str) -> dict:
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        # A write that invalidates this user mid-load keeps the now-stale snapshot out.
+        generation = profile_cache.generation()
+        profile = _load_profile(user_id)
+        profile_cache.set(user_id, profile, generation=generation)
+    return profile
+
+# --- User Lookup ---
+# email -> users.id. Ids are immutable once assigned, so entries never need invalidating;
+# new ids are only cached after the transaction that created them commits.
+user_id_cache = TTLCache(maxsize=int(os.getenv("USER_ID_CACHE_SIZE", "100000")), ttl=None)
+
+def get_or_create_user(session, email: str) -> int:
+    user_pk = user_id_cache.get(email)
+    if user_pk is not None:
+        return user_pk
+    inserted = session.execute(
+        sqlite_insert(User).values(email=email, created_at=datetime.datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["email"])
+    ).rowcount
+    user_pk = session.execute(select(User.id).where(User.email == email)).scalar_one()
+    if inserted:
+        session.info.setdefault("new_user_ids", {})[email] = user_pk
+    else:
+        user_id_cache.set(email, user_pk)
+    return user_pk
+
+@event.listens_for(WriteSessionLocal, "after_commit")
+def _cache_new_user_ids(session):
+    for email, user_pk in session.info.pop("new_user_ids", {}).items():
+        user_id_cache.set(email, user_pk)
+
+@event.listens_for(WriteSessionLocal, "after_rollback")
+def _drop_new_user_ids(session):
+    session.info.pop("new_user_ids", None)
+
+# --- Purchase History Cache ---
+# Opt-in set of product ids each user has ever ordered, so "you already ordered this"
+# checks are a set lookup. checkout() keeps the local entry current, but the cache is per
+# process: orders placed by another worker show up only after the TTL. Off by default, so
+# is_duplicate_order runs a single-row EXISTS query that is always current.
+PURCHASED_CACHE_ENABLED = os.getenv("PURCHASED_CACHE_ENABLED", "0") == "1"
+purchased_cache = TTLCache(
+    maxsize=int(os.getenv("PURCHASED_CACHE_MAX_USERS", "10000")),
+    ttl=float(os.getenv("PURCHASED_CACHE_TTL_SECONDS", "300")),
+)
+
+def _load_purchased_products(user_id: str) -> frozenset:
+    session = SessionLocal()
+    rows = session.query(OrderItem.product_id).join(Order, OrderItem.order_id == Order.id) \
+        .join(User, Order.user_id == User.id).filter(User.email == user_id).distinct().all()
+    session.close()
+    return frozenset(row.product_id for row in rows)
+
+def _purchased_products(user_id: str) -> frozenset:
+    if not PURCHASED_CACHE_ENABLED:
+        return _load_purchased_products(user_id)
+    purchased = purchased_cache.get(user_id)
+    if purchased is None:
+        purchased = _load_purchased_products(user_id)
+        purchased_cache.set(user_id, purchased)
+    return purchased
+
+def _record_purchases(user_id: str, product_ids: set) -> None:
+    purchased = purchased_cache.get(user_id)
+    if purchased is not None:
+        purchased_cache.set(user_id, purchased | product_ids)
 
 # --- Tool Functions ---
+PRODUCT_LIST_MAX_ITEMS = int(os.getenv("PRODUCT_LIST_MAX_ITEMS", "50"))
+SEARCH_MAX_RESULTS = 20
+# Full-text matches handed to the filter/stock ranking stage first; grown when filters leave too few.
+SEARCH_FTS_CANDIDATES = 200
+product_search_index = ProductSearchIndex(engine, catalog)
+
 @tool
-def get_product_list() -> List[dict]:
-    return PRODUCTS
+def get_product_list() -> Union[List[dict], dict]:
+    # Dumping a real catalog into the prompt is never what the model wants; past the
+    # guard it gets a sample plus a pointer to search_products.
+    ensure_inventory()
+    if len(catalog) <= PRODUCT_LIST_MAX_ITEMS:
+        return [dict(product, stock=available_stock(product["id"])) for product in catalog]
+    return {
+        "total_products": len(catalog),
+        "products": catalog.search(limit=PRODUCT_LIST_MAX_ITEMS, stock_of=available_stock),
+        "note": "Catalog too large to list in full. Use search_products with a query and filters.",
+    }
+
+@tool
+def search_products(
+    query: Optional[str] = None,
+    brand: Optional[str] = None,
+    color: Optional[str] = None,
+    style: Optional[str] = None,
+    max_price: Optional[float] = None,
+    in_stock_only: bool = False,
+    limit: int = 5,
+) -> List[dict]:
+    """Find products by free-text query (e.g. "green hoodie") and optional brand/color/style/price filters, best matches first."""
+    ensure_inventory()
+    limit = max(1, min(limit, SEARCH_MAX_RESULTS))
+    candidates = SEARCH_FTS_CANDIDATES
+    while True:
+        relevance = product_search_index.match(query, limit=candidates) if query else None
+        results = catalog.search(
+            query=query,
+            brand=brand,
+            color=color,
+            style=style,
+            max_price=max_price,
+            in_stock_only=in_stock_only,
+            limit=limit,
+            stock_of=available_stock,
+            relevance_by_id=relevance,
+        )
+        # The filters run after the FTS cut, so widen it until enough matches survive
+        # them or FTS has nothing more to return.
+        if relevance is None or len(results) >= limit or len(relevance) < candidates:
+            return results
+        candidates *= 4
 
 @tool
 def check_stock(product_id: str) -> dict:
-    for p in PRODUCTS:
-        if p["id"] == product_id:
-            return {"product_id": product_id, "stock": p["stock"]}
-    return {"product_id": product_id, "stock": 0}
+    ensure_inventory()
+    return {"product_id": product_id, "stock": available_stock(product_id)}
 
 @tool
 def add_to_cart(user_id: str, product_id: str, quantity: int = 1) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    cart_item = session.query(Cart).filter_by(user_id=user.id, product_id=product_id).first()
+    if quantity < 1:
+        return f"Quantity must be at least 1, got {quantity}."
+    ensure_inventory()
+    if product_id not in catalog:
+        return f"Product {product_id} not found."
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=RESERVATION_TTL_SECONDS)
+    on_hand = select(Inventory.stock).where(Inventory.product_id == product_id).scalar_subquery()
+    held = session.execute(
+        insert(Reservation).from_select(
+            ["user_id", "product_id", "quantity", "expires_at"],
+            select(literal(user_pk), literal(product_id), literal(quantity), literal(expires_at, DateTime))
+            .where(on_hand - _reserved_by_others(product_id, now) >= quantity),
+        )
+    ).rowcount
+    if not held:
+        session.rollback()
+        session.close()
+        return f"Sorry, only {available_stock(product_id)} of {product_id} available."
+    # Adding more of the same item restarts the clock on everything already held.
+    session.execute(
+        update(Reservation)
+        .where(Reservation.user_id == user_pk, Reservation.product_id == product_id)
+        .values(expires_at=expires_at)
+    )
+    cart_item = session.query(Cart).filter_by(user_id=user_pk, product_id=product_id).first()
     if cart_item:
         cart_item.quantity += quantity
     else:
-        cart_item = Cart(user_id=user.id, product_id=product_id, quantity=quantity)
+        cart_item = Cart(user_id=user_pk, product_id=product_id, quantity=quantity)
         session.add(cart_item)
     session.commit()
     session.close()
+    reservation_counter.add(product_id, quantity)
     return f"Added {quantity} of {product_id} to {user_id}'s cart."
 
 @tool
 def set_address(user_id: str, address: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.addresses.append(Address(address=address))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Address, {"user_id": user_pk}, {"address": address})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Address for {user_id} set to: {address}"
 
 @tool
 def get_address(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.addresses)).filter_by(email=user_id).first()
-    if user and user.addresses:
-        result = user.addresses[0].address
-    else:
-        result = "No address set."
-    session.close()
-    return result
+    return get_profile(user_id)["address"] or "No address set."
 
 @tool
 def set_size(user_id: str, size: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.sizes.append(Size(size=size))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Size, {"user_id": user_pk}, {"size": size})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Size for {user_id} set to: {size}"
 
 @tool
 def get_size(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.sizes)).filter_by(email=user_id).first()
-    if user and user.sizes:
-        result = user.sizes[0].size
-    else:
-        result = "No size set."
-    session.close()
-    return result
+    return get_profile(user_id)["size"] or "No size set."
 
 @tool
 def set_calendar_location(user_id: str, location: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.travels.append(Travel(status="home", location=location)) # Assuming default to home
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Travel, {"user_id": user_pk}, {"status": "home", "location": location}) # Assuming default to home
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Calendar location for {user_id} set to: {location}"
 
 @tool
 def get_calendar_location(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    session.close()
-    if user and user.travels:
-        return user.travels[0].location if user.travels else "office"
-    return "office"
+    travel = get_profile(user_id)["travel"]
+    return travel["location"] if travel else "office"
 
 @tool
 def set_payment_method(user_id: str, method: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.payments.append(Payment(method=method))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Payment, {"user_id": user_pk}, {"method": method})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Payment method set to {method}"
 
 @tool
 def get_payment_method(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.payments)).filter_by(email=user_id).first()
-    if user and user.payments:
-        result = user.payments[0].method
-    else:
-        result = "No payment method set."
-    session.close()
-    return result
+    return get_profile(user_id)["payment"] or "No payment method set."
 
 @tool
 def set_preference(user_id: str, key: str, value: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.preferences.append(Preference(key=key, value=value))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Preference, {"user_id": user_pk, "key": key}, {"value": value})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Preference {key} set to {value}"
 
 @tool
 def get_preference(user_id: str, key: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    session.close()
-    if user and user.preferences:
-        pref = next((p for p in user.preferences if p.key == key), None)
-        return pref.value if pref else "Not set"
-    return "Not set"
+    return get_profile(user_id)["preferences"].get(key, "Not set")
 
 @tool
 def set_travel_status(user_id: str, status: str, location: str = "") -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.travels.append(Travel(status=status, location=location))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Travel, {"user_id": user_pk}, {"status": status, "location": location})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Travel status set to {status} at {location}"
 
 @tool
 def get_travel_status(user_id: str) -> dict:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.travels)).filter_by(email=user_id).first()
-    if user and user.travels:
-        travel = user.travels[0]
-        result = {"status": travel.status, "location": travel.location}
-    else:
-        result = {"status": "home", "location": get_address(user_id)}
-    session.close()
-    return result
+    profile = get_profile(user_id)
+    if profile["travel"]:
+        return dict(profile["travel"])
+    return {"status": "home", "location": profile["address"] or "No address set."}
 
 @tool
-def checkout(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.addresses), joinedload(User.carts)).filter_by(email=user_id).first()
-    if not user:
-        session.close()
-        return "User not found. Please register."
+def update_profile(
+    user_id: str,
+    address: Optional[str] = None,
+    size: Optional[str] = None,
+    payment: Optional[str] = None,
+    preferences: Optional[Dict[str, str]] = None,
+    travel: Optional[Dict[str, str]] = None,
+) -> str:
+    """Save any combination of address, size, payment method, preferences ({key: value}) and travel ({"status": ..., "location": ...}) in one call."""
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    updated = []
+    if address is not None:
+        upsert(session, Address, {"user_id": user_pk}, {"address": address})
+        updated.append(f"address: {address}")
+    if size is not None:
+        upsert(session, Size, {"user_id": user_pk}, {"size": size})
+        updated.append(f"size: {size}")
+    if payment is not None:
+        upsert(session, Payment, {"user_id": user_pk}, {"method": payment})
+        updated.append(f"payment: {payment}")
+    for key, value in (preferences or {}).items():
+        upsert(session, Preference, {"user_id": user_pk, "key": key}, {"value": value})
+        updated.append(f"{key}: {value}")
+    if travel:
+        status, location = travel.get("status", "traveling"), travel.get("location", "")
+        upsert(session, Travel, {"user_id": user_pk}, {"status": status, "location": location})
+        updated.append(f"travel: {status} at {location}")
+    session.commit()
+    session.close()
+    if not updated:
+        return "Nothing to update."
+    profile_cache.invalidate(user_id)
+    return "Profile updated (" + "; ".join(updated) + ")"
 
-    if not user.addresses:
-        session.close()
-        return "No address set. Please provide a shipping address before checkout."
+@tool
+def checkout(user_id: str) -> dict:
+    ensure_inventory()
+    session = WriteSessionLocal()
+    try:
+        user = session.query(User.id).filter_by(email=user_id).first()
+        if not user:
+            return {"status": "error", "message": "User not found. Please register."}
+        address = session.query(Address.address).filter_by(user_id=user.id).order_by(Address.id).first()
+        if not address:
+            return {"status": "error", "message": "No address set. Please provide a shipping address before checkout."}
+        lines = [
+            (row.product_id, row.quantity)
+            for row in session.query(Cart.product_id, Cart.quantity).filter_by(user_id=user.id)
+            if row.product_id in catalog
+        ]
+        if not lines:
+            return {"status": "error", "message": "Your cart is empty."}
+        # A non-positive line would add stock back instead of taking it out.
+        invalid = [product_id for product_id, quantity in lines if quantity < 1]
+        if invalid:
+            return {"status": "error", "message": f"Invalid quantity in cart for: {', '.join(invalid)}."}
 
-    order_id = str(uuid.uuid4())
-    order = Order(user_id=user.id, address=user.addresses[0].address, status="Processing")
-    session.add(order)
-    session.commit()  # Commit to get order.id
+        # Decrement only where enough stock remains once other users' live holds are set
+        # aside, so concurrent checkouts across workers can never oversell; any short
+        # line rolls the whole order back. Only this user's live holds are released from
+        # the counter; expired ones are settled when the sweeper rebuilds it.
+        now = datetime.datetime.utcnow()
+        held = dict(
+            session.query(Reservation.product_id, func.sum(Reservation.quantity))
+            .filter(Reservation.user_id == user.id, Reservation.expires_at > now)
+            .group_by(Reservation.product_id)
+        )
+        remaining, unavailable = {}, []
+        for product_id, quantity in lines:
+            stock = session.execute(
+                update(Inventory)
+                .where(
+                    Inventory.product_id == product_id,
+                    Inventory.stock - _reserved_by_others(product_id, now, user.id) >= quantity,
+                )
+                .values(stock=Inventory.stock - quantity)
+                .returning(Inventory.stock)
+            ).scalar()
+            if stock is None:
+                unavailable.append(product_id)
+            else:
+                remaining[product_id] = stock
+        if unavailable:
+            session.rollback()
+            return {"status": "out_of_stock", "unavailable": unavailable}
 
-    for item in user.carts:
-        product = next((p for p in PRODUCTS if p["id"] == item.product_id), None)
-        if product:
-            order_item = OrderItem(order_id=order.id, product_id=item.product_id, quantity=item.quantity)
-            session.add(order_item)
-            product["stock"] = max(0, product["stock"] - item.quantity)
-        session.delete(item)  # Remove from cart after checkout
+        order = Order(user_id=user.id, address=address.address, status="Processing")
+        session.add(order)
+        session.flush()
+        session.execute(
+            insert(OrderItem),
+            [{"order_id": order.id, "product_id": product_id, "quantity": quantity} for product_id, quantity in lines],
+        )
+        session.execute(delete(Cart).where(Cart.user_id == user.id))
+        session.execute(delete(Reservation).where(Reservation.user_id == user.id))
+        session.commit()
+        order_id = order.id
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
-    session.commit()
-    session.close()
-    return f"Order placed! Your order ID is {order_id}."
+    for product_id, stock in remaining.items():
+        catalog.set_stock(product_id, stock)
+    for product_id, quantity in held.items():
+        reservation_counter.release(product_id, quantity)
+    _record_purchases(user_id, set(remaining))
+    items = []
+    for product_id, quantity in lines:
+        product = catalog.get(product_id)
+        items.append({"product_id": product_id, "name": product["name"], "quantity": quantity, "price": product["price"]})
+    return {
+        "status": "placed",
+        "order_id": order_id,
+        "address": address.address,
+        "items": items,
+        "total": round(sum(i["price"] * i["quantity"] for i in items), 2),
+    }
 
 @tool
 def check_order_status(order_id: str) -> str:
@@ -330,113 +689,278 @@ def check_order_status(order_id: str) -> str:
 def check_delivery_date(product_id: str, zip_code: str) -> str:
     return f"Estimated delivery for {product_id} to {zip_code}: 3-5 business days."
 
+recommender = Recommender(catalog)
+RECOMMEND_MAX_RESULTS = 10
+
+def _preference_signals(preferences: Dict[str, str]) -> dict:
+    # Free-form preference rows such as favorite_brand=Nike or colors="black, white".
+    signals = {"brands": [], "colors": [], "styles": [], "max_price": None}
+    for key, value in preferences.items():
+        key = key.lower()
+        for field in ("brand", "color", "style"):
+            if field in key:
+                signals[field + "s"].extend(v.strip() for v in value.split(",") if v.strip())
+        if key in ("budget", "max_price"):
+            try:
+                signals["max_price"] = float(value.strip().lstrip("$"))
+            except ValueError:
+                pass
+    return signals
+
 @tool
-def recommend_products(user_profile: dict) -> List[dict]:
-    matches = []
-    for p in PRODUCTS:
-        if (p["brand"] in user_profile.get("brands", [])) or \
-           (p["color"] in user_profile.get("colors", [])) or \
-           (p["style"] in user_profile.get("styles", [])):
-            matches.append(p)
-        if len(matches) >= 3:
-            break
-    return matches
+def recommend_products(user_profile: dict, user_id: Optional[str] = None, limit: int = 3) -> List[dict]:
+    """Recommend in-stock products for a profile ({"brands": [...], "colors": [...], "styles": [...], "max_price": ...}); pass user_id to also use saved preferences and past orders."""
+    ensure_inventory()
+    brands = list(user_profile.get("brands", []))
+    colors = list(user_profile.get("colors", []))
+    styles = list(user_profile.get("styles", []))
+    max_price = user_profile.get("max_price")
+    purchased = frozenset()
+    if user_id:
+        signals = _preference_signals(get_profile(user_id)["preferences"])
+        brands += signals["brands"]
+        colors += signals["colors"]
+        styles += signals["styles"]
+        max_price = max_price if max_price is not None else signals["max_price"]
+        purchased = _purchased_products(user_id)
+    return recommender.recommend(
+        brands=brands,
+        colors=colors,
+        styles=styles,
+        purchased=purchased,
+        max_price=max_price,
+        limit=max(1, min(limit, RECOMMEND_MAX_RESULTS)),
+        stock_of=available_stock,
+    )
 
 @tool
 def get_birthday(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    session.close()
-    if user and user.birthdays:
-        return user.birthdays[0].birthday if user.birthdays else ""
-    return ""
+    return get_profile(user_id)["birthday"] or ""
+
+ORDER_HISTORY_PAGE_SIZE = int(os.getenv("ORDER_HISTORY_PAGE_SIZE", "10"))
+ORDER_HISTORY_MAX_PAGE_SIZE = 50
+
+ORDER_CURSOR_ERROR = {
+    "status": "error",
+    "message": "Invalid cursor. Pass next_cursor from the previous page unchanged, or no cursor for the first page.",
+}
+
+def parse_order_cursor(cursor: str) -> Optional[Tuple[datetime.datetime, int]]:
+    # The model hands the cursor back, so anything other than "<iso created_at>|<id>" is None.
+    created_at, _, order_pk = cursor.rpartition("|")
+    try:
+        return datetime.datetime.fromisoformat(created_at), int(order_pk)
+    except ValueError:
+        return None
+
+def _order_history_page(session, user_id: str, cursor: Optional[str], page_size: int, include_items: bool) -> dict:
+    # Keyset pagination on (created_at, id), newest first, served by ix_orders_user_id_created_at_id;
+    # each page costs the same no matter how deep into the history it is.
+    page_size = max(1, min(page_size, ORDER_HISTORY_MAX_PAGE_SIZE))
+    columns = [Order.id, Order.status, Order.address, Order.created_at]
+    if include_items:
+        items = select(
+            func.group_concat(OrderItem.product_id.concat(" x").concat(cast(OrderItem.quantity, String)), ", ")
+        ).where(OrderItem.order_id == Order.id).scalar_subquery()
+        columns.append(items.label("items"))
+    query = session.query(*columns).join(User, Order.user_id == User.id).filter(User.email == user_id)
+    if cursor:
+        position = parse_order_cursor(cursor)
+        if position is None:
+            return dict(ORDER_CURSOR_ERROR)
+        query = query.filter(tuple_(Order.created_at, Order.id) < tuple_(*position))
+    rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(page_size + 1).all()
+    orders = []
+    for row in rows[:page_size]:
+        order = {
+            "id": row.id,
+            "status": row.status,
+            "address": row.address,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        if include_items:
+            order["items"] = row.items or ""
+        orders.append(order)
+    next_cursor = None
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        next_cursor = f"{last.created_at.isoformat()}|{last.id}"
+    return {"orders": orders, "next_cursor": next_cursor}
 
 @tool
-def get_order_history(user_id: str) -> List[Dict]:
+def get_order_history(user_id: str, cursor: Optional[str] = None, page_size: int = ORDER_HISTORY_PAGE_SIZE, include_items: bool = False) -> dict:
+    """Return one page of the user's orders, newest first. Pass next_cursor back as cursor for the next page."""
     session = SessionLocal()
-    user = session.query(User).options(joinedload(User.orders)).filter_by(email=user_id).first()
-    if not user or not user.orders:
-        result = []
-    else:
-        result = [
-            {
-                "id": o.id,
-                "address": o.address,
-                "status": o.status,
-                "created_at": o.created_at.isoformat() if o.created_at else None
-            }
-            for o in user.orders
-        ]
-    session.close()
-    return result
+    try:
+        return _order_history_page(session, user_id, cursor, page_size, include_items)
+    finally:
+        session.close()
 
 @tool
 def is_duplicate_order(user_id: str, product_id: str) -> bool:
+    if PURCHASED_CACHE_ENABLED:
+        return product_id in _purchased_products(user_id)
     session = SessionLocal()
-    user = session.query(User).options(joinedload(User.orders).joinedload(Order.items)).filter_by(email=user_id).first()
-    found = False
-    if user and user.orders:
-        for order in user.orders:
-            for item in order.items:
-                if item.product_id == product_id:
-                    found = True
-                    break
-            if found:
-                break
+    found = session.query(
+        exists()
+        .where(OrderItem.order_id == Order.id)
+        .where(Order.user_id == User.id)
+        .where(User.email == user_id)
+        .where(OrderItem.product_id == product_id)
+    ).scalar()
     session.close()
     return found
 
 @tool
 def set_concierge_tone(user_id: str, tone: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.preferences.append(Preference(key="concierge_tone", value=tone))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Preference, {"user_id": user_pk, "key": "concierge_tone"}, {"value": tone})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Concierge tone set to {tone}"
 
 @tool
 def get_concierge_tone(user_id: str) -> str:
+    return get_profile(user_id)["preferences"].get("concierge_tone", "professional")
+
+@tool
+def get_user_context(user_id: str, max_orders: int = 5) -> dict:
+    """Return the user's full profile, cart and most recent orders in one call."""
+    generation = profile_cache.generation()
     session = SessionLocal()
-    user = session.query(User).options(joinedload(User.preferences)).filter_by(email=user_id).first()
-    if user and user.preferences:
-        pref = next((p for p in user.preferences if p.key == "concierge_tone"), None)
-        result = pref.value if pref else "professional"
-    else:
-        result = "professional"
+    user = session.query(User).options(
+        *(selectinload(rel) for rel in PROFILE_RELATIONSHIPS),
+        selectinload(User.carts),
+    ).filter_by(email=user_id).first()
+    profile = _snapshot_profile(user)
+    profile_cache.set(user_id, profile, generation=generation)
+    context = {
+        "address": profile["address"],
+        "size": profile["size"],
+        "payment": profile["payment"],
+        "preferences": profile["preferences"],
+        "concierge_tone": profile["preferences"].get("concierge_tone", "professional"),
+        "travel": profile["travel"] or {"status": "home", "location": profile["address"]},
+        "birthday": profile["birthday"],
+        "cart": [],
+        "recent_orders": [],
+    }
+    if user:
+        context["cart"] = [{"product_id": c.product_id, "quantity": c.quantity} for c in user.carts]
+        context["recent_orders"] = _order_history_page(session, user_id, None, max_orders, include_items=True)["orders"]
     session.close()
-    return result
+    return context
 
 # --- Persistent Memory Setup ---
-memory = Memory(
-    db=SqliteMemoryDb(table_name="memory", db_file="memory.db"),
-)
+# "async" moves user-memory extraction off the turn: runs only queue their messages and a
+# background worker extracts them per user, at most MEMORY_EXTRACTION_MAX_LAG_SECONDS later.
+# "sync" keeps agno's inline extraction.
+MEMORY_EXTRACTION_MODE = os.getenv("MEMORY_EXTRACTION_MODE", "async")
+# Replayed history is fitted to HISTORY_TOKEN_BUDGET (tool results shrunk, older turns folded
+# into a rolling summary) instead of num_history_runs verbatim runs. 0 disables it.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+HISTORY_TOOL_RESULT_MAX_CHARS = int(os.getenv("HISTORY_TOOL_RESULT_MAX_CHARS", "600"))
+
+@lru_cache(maxsize=None)
+def get_memory() -> "Memory":
+    from agno.memory.v2.db.sqlite import SqliteMemoryDb
+    from concierge_memory import ConciergeMemory
+    from history import HistoryCompactor
+
+    history = None
+    if HISTORY_TOKEN_BUDGET > 0:
+        history = HistoryCompactor(token_budget=HISTORY_TOKEN_BUDGET, tool_result_max_chars=HISTORY_TOOL_RESULT_MAX_CHARS)
+    # The model is set here rather than by the first agent that runs: a team member works on
+    # a copy of its memory, so the original (which runs queued extraction) would never get one.
+    return ConciergeMemory(
+        db=SqliteMemoryDb(table_name="memory", db_file="memory.db"),
+        model=get_model(),
+        defer_extraction=MEMORY_EXTRACTION_MODE == "async",
+        max_lag_seconds=float(os.getenv("MEMORY_EXTRACTION_MAX_LAG_SECONDS", "5")),
+        batch_size=int(os.getenv("MEMORY_EXTRACTION_BATCH_SIZE", "8")),
+        history=history,
+    )
+
+def _local_memory() -> "Memory":
+    # The coffee and profile agents keep their memories in process, as agno's default
+    # Memory would; ConciergeMemory so their replayed history drops the request context too.
+    from concierge_memory import ConciergeMemory
+
+    return ConciergeMemory(model=get_model(), defer_extraction=False)
 
 # --- Shopping Session State Helper ---
+# Each session's slots live in one row of the memory db (see slots.MemoryDbSlotStore). They
+# are cached per (user_id, session_id) and written back at the end of each turn
+# (route_message), every SLOT_FLUSH_INTERVAL_SECONDS, or when the session is evicted.
+# Set SLOT_CACHE_ENABLED=0 to write through on every call.
+SLOT_CACHE_ENABLED = os.getenv("SLOT_CACHE_ENABLED", "1") == "1"
+SHOPPING_SLOTS = ("product", "size", "address", "payment")
+slot_cache = SlotCache(
+    max_sessions=int(os.getenv("SLOT_CACHE_MAX_SESSIONS", "10000")),
+    idle_seconds=float(os.getenv("SLOT_CACHE_IDLE_SECONDS", "1800")),
+    flush_interval=float(os.getenv("SLOT_FLUSH_INTERVAL_SECONDS", "5")),
+)
+
 class ShoppingSession:
-    def __init__(self, memory: Memory, user_id: str, session_id: str):
+    def __init__(self, memory: "Memory", user_id: str, session_id: str):
         self.memory = memory
+        self.store = MemoryDbSlotStore(memory.db)
         self.user_id = user_id
         self.session_id = session_id
+        self.key = (user_id, session_id)
+        if SLOT_CACHE_ENABLED:
+            slot_cache.start()
 
     def get_slot(self, slot: str) -> Optional[str]:
-        return self.memory.get(f"shopping_{slot}", user_id=self.user_id, session_id=self.session_id)
+        if SLOT_CACHE_ENABLED:
+            return slot_cache.get(self.key, self.store, slot)
+        return self.store.load(self.user_id, self.session_id).get(slot)
 
     def set_slot(self, slot: str, value: str):
-        self.memory.set(f"shopping_{slot}", value, user_id=self.user_id, session_id=self.session_id)
+        if SLOT_CACHE_ENABLED:
+            slot_cache.set(self.key, self.store, slot, value)
+            return
+        slots = self.store.load(self.user_id, self.session_id)
+        slots[slot] = value
+        self.store.save(self.user_id, self.session_id, slots)
 
     def clear(self):
-        for slot in ["product", "size", "address", "payment"]:
-            self.memory.delete(f"shopping_{slot}", user_id=self.user_id, session_id=self.session_id)
+        if SLOT_CACHE_ENABLED:
+            slot_cache.set_many(self.key, self.store, dict.fromkeys(SHOPPING_SLOTS))
+            return
+        self.store.save(self.user_id, self.session_id, {})
 
-# Example usage in tool functions (pseudo):
-# session = ShoppingSession(memory, user_id, session_id)
-# session.set_slot("product", "Classic Blue Jeans")
-# size = session.get_slot("size")
+    def flush(self) -> int:
+        return slot_cache.flush(self.key) if SLOT_CACHE_ENABLED else 0
+
+@tool
+def get_shopping_session(user_id: str, session_id: str) -> dict:
+    """The product, size, address and payment in progress for this shopping session."""
+    session = ShoppingSession(get_memory(), user_id, session_id)
+    return {slot: session.get_slot(slot) for slot in SHOPPING_SLOTS}
+
+@tool
+def set_shopping_session(
+    user_id: str,
+    session_id: str,
+    product: Optional[str] = None,
+    size: Optional[str] = None,
+    address: Optional[str] = None,
+    payment: Optional[str] = None,
+    clear: bool = False,
+) -> str:
+    """Record the session's current product, size, address and/or payment; clear=True starts over first."""
+    session = ShoppingSession(get_memory(), user_id, session_id)
+    if clear:
+        session.clear()
+    updates = {"product": product, "size": size, "address": address, "payment": payment}
+    for slot, value in updates.items():
+        if value is not None:
+            session.set_slot(slot, value)
+    changed = ", ".join(f"{slot}: {value}" for slot, value in updates.items() if value is not None)
+    return f"Session updated ({changed})" if changed else ("Session cleared" if clear else "Nothing to update")
 
 # --- Concierge Instructions ---
 concierge_instructions = [
@@ -445,14 +969,17 @@ concierge_instructions = [
     "Current Session ID: {current_session_id}",
     "Always be brief, direct, and professional. Responses must be short, crisp, and perfect—never verbose.",
     "Never mention user_id, email, or tool call arguments in your response.",
-    "Maintain a shopping session state for each user and session, tracking the current product, size, address, and payment method.",
+    "Call get_user_context once at the start of a request to load the user's address, size, payment, preferences, travel status, birthday, cart and recent orders; only use the individual get_* tools if something changed since.",
+    "Maintain a shopping session state for each user and session, tracking the current product, size, address, and payment method: read it with get_shopping_session and record changes with set_shopping_session, passing the Current Session ID.",
+    "To find products, call search_products with the user's words as the query plus any brand, color, style or price constraints; only use get_product_list when the user asks to browse everything.",
     "When a user requests a product, always show product details (name, brand, price, stock) before proceeding, and store the product in session state.",
     "If the user provides a size, address, or payment, update the session state accordingly.",
+    "To save profile details (address, size, payment, preferences, travel), make a single update_profile call with every field the user gave in that message.",
     "If the user refers to 'the jeans', 'the 32 one', or similar, use the most recently discussed product and size from the session state.",
     "If multiple products match, list options and ask the user to choose, then store the choice in session state.",
     "Before placing an order, confirm all key details: product, size (if relevant), delivery address, and payment method. Summarize these for the user and ask for explicit confirmation before placing the order.",
     "If information is missing (e.g., size, address, payment), summarize what is needed and politely ask only for the missing detail.",
-    "If an item is out of stock, suggest alternatives or offer to notify when available.",
+    "If an item is out of stock, suggest alternatives or offer to notify when available; call recommend_products with the user's user_id so saved preferences and past orders are taken into account.",
     "Example: 'I found Classic Blue Jeans by Levi's ($89.99, in stock). What size would you like?'",
     "Example: 'Great! Size 32 selected. Your delivery address is 123 Main St, Springfield, 90210, and payment will be with Visa ending 5678. Shall I place the order?'",
     "Example: 'Order placed: Classic Blue Jeans (size: 32). Delivery: 123 Main St, Springfield, 90210. Payment: Visa ending 5678.'",
@@ -465,45 +992,95 @@ concierge_instructions = [
     "Tone: short, crisp, professional, and user-friendly. If a specific brand or persona is set, match that style (e.g., luxury, playful, ultra-formal, minimalist, etc.).",
 ]
 
-# --- Create the Concierge Shopping Agent ---
-shopping_agent = AgnoAgent(
-    name="Concierge Shopping Agent",
-    model=OpenAIChat(id="gpt-4o"),
-    tools=[
-        get_product_list,
-        check_stock,
-        add_to_cart,
-        set_address,
+# --- Shopping Tool Gating ---
+# Each shopping turn only sends the schemas of the tool groups it needs: groups whose intent
+# patterns match the message, plus what the session's slots call for (a product in progress
+# brings in the cart tools, and the profile tools while size/address/payment are missing).
+SHOPPING_TOOL_GROUPS = {
+    "core": [get_user_context, search_products, check_stock, get_shopping_session, set_shopping_session],
+    "catalog": [get_product_list, recommend_products, check_delivery_date],
+    "cart": [add_to_cart, checkout, is_duplicate_order, check_delivery_date],
+    "profile": [
+        update_profile,
         get_address,
-        set_size,
         get_size,
-        set_calendar_location,
-        get_calendar_location,
-        set_payment_method,
         get_payment_method,
-        set_preference,
         get_preference,
-        set_travel_status,
+        set_calendar_location,
+        get_calendar_location,
         get_travel_status,
-        checkout,
-        check_order_status,
-        check_delivery_date,
-        recommend_products,
         get_birthday,
-        get_order_history,
-        is_duplicate_order,
         set_concierge_tone,
         get_concierge_tone,
     ],
-    memory=memory,
-    enable_user_memories=True,
-    add_history_to_messages=True,
-    num_history_runs=3,
-    instructions=concierge_instructions,
-    show_tool_calls=True,
-    markdown=True,
-    add_state_in_messages=True,
+    "orders": [check_order_status, get_order_history, is_duplicate_order],
+}
+SHOPPING_TOOL_INTENTS = {
+    "core": [r"find|search|looking for|need|want|have|in stock|jeans|dress|hoodie|sneakers|shoes|shirt|jacket"],
+    "catalog": [r"show|browse|catalog|recommend\w*|suggest\w*|similar|alternatives?|options|deliver\w*|arriv\w*"],
+    "cart": [r"buy|purchase|add|cart|checkout|check out|order (?:a|an|the|it|this|that|one|some)|place (?:the |an )?order|confirm|yes|go ahead|proceed"],
+    "profile": [
+        r"size|waist|inseam|address|ship\w*|payment|card|amex|visa|mastercard|pay",
+        r"prefer\w*|tone|style|birthday|travel\w*|trip|calendar|location|home|office",
+    ],
+    "orders": [r"order status|my orders?|order history|past orders?|previous orders?|track\w*|again|already"],
+}
+shopping_tool_gate = ToolGate(
+    SHOPPING_TOOL_GROUPS,
+    SHOPPING_TOOL_INTENTS,
+    always=["core"],
+    slot_rules={"product": ["cart"], "!size": ["profile"], "!address": ["profile"], "!payment": ["profile"]},
+    active_slot="product",
 )
+TOOL_GATING_ENABLED = os.getenv("TOOL_GATING_ENABLED", "1") == "1"
+
+# --- Prompt Layout ---
+# "stable" keeps every system prompt byte-identical across users and sessions so provider
+# prompt-prefix caching applies: instructions with {state} placeholders are dropped from the
+# system prompt, state is not injected there, and route_message appends the per-request
+# values and the user's memories to the end of the user message instead. "legacy" keeps
+# them inline.
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "stable")
+STABLE_PROMPTS = PROMPT_LAYOUT == "stable"
+REQUEST_CONTEXT = split_instructions(concierge_instructions)[1]
+
+def _instructions(lines: List[str]) -> List[str]:
+    return split_instructions(lines)[0] if STABLE_PROMPTS else lines
+
+def request_context(user_id: str, session_id: str) -> str:
+    context = render_context(REQUEST_CONTEXT, {"current_user_id": user_id, "current_session_id": session_id})
+    memories = render_memories([m.memory for m in get_memory().get_user_memories(user_id=user_id)])
+    return "\n".join(part for part in (context, memories) if part)
+
+# --- Model ---
+# Every agent and the team get their model from here; the offline benchmarks replace this
+# function with a scripted stub so no flow needs a gpt-4o call.
+def get_model():
+    from agno.models.openai import OpenAIChat
+
+    return OpenAIChat(id="gpt-4o")
+
+# --- Create the Concierge Shopping Agent ---
+@lru_cache(maxsize=None)
+def get_shopping_agent(tool_groups: Optional[FrozenSet[str]] = None) -> "AgnoAgent":
+    # One agent per tool subset; they share memory, so history carries across subsets.
+    from agno.agent import Agent as AgnoAgent
+
+    init_db()
+    return AgnoAgent(
+        name="Concierge Shopping Agent",
+        model=get_model(),
+        tools=shopping_tool_gate.tools_for(tool_groups),
+        memory=get_memory(),
+        enable_user_memories=True,
+        add_memory_references=not STABLE_PROMPTS,
+        add_history_to_messages=True,
+        num_history_runs=3,
+        instructions=_instructions(concierge_instructions),
+        show_tool_calls=True,
+        markdown=True,
+        add_state_in_messages=not STABLE_PROMPTS,
+    )
 
 # --- Coffee Agent Tool Functions ---
 def get_coffee_menu() -> list:
@@ -516,180 +1093,231 @@ def get_coffee_menu() -> list:
 
 @tool
 def order_coffee(user_id: str, coffee_id: str, size: str = "medium") -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.addresses), joinedload(User.payments), joinedload(User.preferences)).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
+    session = WriteSessionLocal()
+    get_or_create_user(session, user_id)
+    session.commit()
+    session.close()
     menu = get_coffee_menu()
     coffee = next((c for c in menu if c["id"] == coffee_id), None)
     if not coffee:
-        session.close()
         return "Sorry, that coffee is not available."
-    address = user.addresses[0].address if user.addresses else "No address set"
-    payment = user.payments[0].method if user.payments else "No payment method set"
-    session.close()
+    profile = get_profile(user_id)
+    address = profile["address"] or "No address set"
+    payment = profile["payment"] or "No payment method set"
     return f"Ordered a {size} {coffee['name']} for {user_id}, to be delivered to {address}, paid with {payment}."
 
 @tool
 def get_coffee_pref(user_id: str, key: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.preferences)).filter_by(email=user_id).first()
-    session.close()
-    if user and user.preferences:
-        pref = next((p for p in user.preferences if p.key == key), None)
-        return pref.value if pref else "Not set"
-    return "Not set"
+    return get_profile(user_id)["preferences"].get(key, "Not set")
 
 @tool
 def set_coffee_pref(user_id: str, key: str, value: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.preferences)).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    user.preferences.append(Preference(key=key, value=value))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Preference, {"user_id": user_pk, "key": key}, {"value": value})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Coffee preference {key} set to {value}"
 
 # --- Coffee Agent ---
 
-coffee_agent = AgnoAgent(
-    name="Coffee Agent",
-    model=OpenAIChat(id="gpt-4o"),
-    tools=[
-        get_coffee_menu,
-        order_coffee,
-        get_coffee_pref,
-        set_coffee_pref,
-        get_address,  # shared
-        set_address,  # shared
-        get_payment_method,  # shared
-        set_payment_method,  # shared
-    ],
-    enable_user_memories=True,
-    add_history_to_messages=True,
-    num_history_runs=3,
-    instructions=[
-        "You are a coffee ordering assistant.",
-        "The user_id argument is always provided by the system and is the user's email (e.g., priya@example.com). Never ask the user for their email or user_id. Always use the user_id argument passed to you for all tool calls.",
-        "Always confirm orders and preferences in short, crisp, user-friendly language.",
-        "Never mention user_id, email, or tool call arguments in your response.",
-        "If information is missing (e.g., size, type), politely ask only for the missing detail.",
-        "If an item is unavailable, suggest alternatives or offer to notify when available.",
-        "Example: 'Coffee preference updated: size large.'",
-        "Example: 'Latte (size: large) ordered.'",
-        "Example: 'Order cancelled.'",
-        "Example: 'Sorry, cappuccino is not available in large. Would you like medium instead?'",
-        "Example: 'Please specify your preferred coffee type.'",
-        "Responses must be natural, never robotic or verbose.",
-        "Tone: short, crisp, professional, and user-friendly. If a specific brand or persona is set, match that style.",
-    ],
-    show_tool_calls=True,
-    markdown=True,
-    add_state_in_messages=True,
-)
+@lru_cache(maxsize=None)
+def get_coffee_agent() -> "AgnoAgent":
+    from agno.agent import Agent as AgnoAgent
+
+    init_db()
+    return AgnoAgent(
+        name="Coffee Agent",
+        model=get_model(),
+        tools=[
+            get_coffee_menu,
+            order_coffee,
+            get_coffee_pref,
+            set_coffee_pref,
+            get_address,  # shared
+            set_address,  # shared
+            get_payment_method,  # shared
+            set_payment_method,  # shared
+        ],
+        memory=_local_memory(),
+        enable_user_memories=True,
+        add_memory_references=not STABLE_PROMPTS,
+        add_history_to_messages=True,
+        num_history_runs=3,
+        instructions=[
+            "You are a coffee ordering assistant.",
+            "The user_id argument is always provided by the system and is the user's email (e.g., priya@example.com). Never ask the user for their email or user_id. Always use the user_id argument passed to you for all tool calls.",
+            "Always confirm orders and preferences in short, crisp, user-friendly language.",
+            "Never mention user_id, email, or tool call arguments in your response.",
+            "If information is missing (e.g., size, type), politely ask only for the missing detail.",
+            "If an item is unavailable, suggest alternatives or offer to notify when available.",
+            "Example: 'Coffee preference updated: size large.'",
+            "Example: 'Latte (size: large) ordered.'",
+            "Example: 'Order cancelled.'",
+            "Example: 'Sorry, cappuccino is not available in large. Would you like medium instead?'",
+            "Example: 'Please specify your preferred coffee type.'",
+            "Responses must be natural, never robotic or verbose.",
+            "Tone: short, crisp, professional, and user-friendly. If a specific brand or persona is set, match that style.",
+        ],
+        show_tool_calls=True,
+        markdown=True,
+        add_state_in_messages=not STABLE_PROMPTS,
+    )
 
 # --- Shared User Profile Agent Tool Functions ---
 @tool
 def set_user_address(user_id: str, address: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.addresses)).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    if user.addresses:
-        user.addresses[0].address = address
-    else:
-        user.addresses.append(Address(address=address))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Address, {"user_id": user_pk}, {"address": address})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Address updated to {address}."
 
-@tool
-def set_payment_method(user_id: str, method: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.payments)).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    if user.payments:
-        user.payments[0].method = method
-    else:
-        user.payments.append(Payment(method=method))
-    session.commit()
-    session.close()
-    return f"Payment method set to {method}."
-
 @tool
 def set_user_pref(user_id: str, key: str, value: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.preferences)).filter_by(email=user_id).first()
-    if not user:
-        user = User(email=user_id)
-        session.add(user)
-        session.commit()
-    pref = next((p for p in user.preferences if p.key == key), None)
-    if pref:
-        pref.value = value
-    else:
-        user.preferences.append(Preference(key=key, value=value))
+    session = WriteSessionLocal()
+    user_pk = get_or_create_user(session, user_id)
+    upsert(session, Preference, {"user_id": user_pk, "key": key}, {"value": value})
     session.commit()
     session.close()
+    profile_cache.invalidate(user_id)
     return f"Preference {key} set to {value} for the user."
 
 # --- User Profile Agent ---
-user_profile_agent = AgnoAgent(
-    name="User Profile Agent",
-    model=OpenAIChat(id="gpt-4o"),
-    tools=[set_user_address, set_payment_method, set_user_pref],
-    enable_user_memories=True,
-    add_history_to_messages=True,
-    num_history_runs=3,
-    instructions=[
-        "You manage user preferences, addresses, and payment methods.",
-        "The user_id argument is always provided by the system and is the user's email (e.g., priya@example.com). Never ask the user for their email or user_id. Always use the user_id argument passed to you for all tool calls.",
-        "Always confirm updates in short, crisp, user-friendly language.",
-        "Never mention user_id, email, or tool call arguments in your response.",
-        "If information is missing, politely ask only for the missing detail.",
-        "Example: 'Address updated to 123 Main St, Springfield, 90210.'",
-        "Example: 'Payment method set to Visa ending 5678.'",
-        "Example: 'Preference updated: style=casual.'",
-        "Example: 'Please provide your preferred payment method.'",
-        "Responses must be natural, never robotic or verbose.",
-        "Tone: short, crisp, professional, and user-friendly. If a specific brand or persona is set, match that style.",
-    ],
-    show_tool_calls=True,
-    markdown=True,
-    add_state_in_messages=True,
-)
+@lru_cache(maxsize=None)
+def get_user_profile_agent() -> "AgnoAgent":
+    from agno.agent import Agent as AgnoAgent
+
+    init_db()
+    return AgnoAgent(
+        name="User Profile Agent",
+        model=get_model(),
+        tools=[update_profile],
+        memory=_local_memory(),
+        enable_user_memories=True,
+        add_memory_references=not STABLE_PROMPTS,
+        add_history_to_messages=True,
+        num_history_runs=3,
+        instructions=[
+            "You manage user preferences, addresses, and payment methods.",
+            "Save everything the user gives in one message with a single update_profile call.",
+            "The user_id argument is always provided by the system and is the user's email (e.g., priya@example.com). Never ask the user for their email or user_id. Always use the user_id argument passed to you for all tool calls.",
+            "Always confirm updates in short, crisp, user-friendly language.",
+            "Never mention user_id, email, or tool call arguments in your response.",
+            "If information is missing, politely ask only for the missing detail.",
+            "Example: 'Address updated to 123 Main St, Springfield, 90210.'",
+            "Example: 'Payment method set to Visa ending 5678.'",
+            "Example: 'Preference updated: style=casual.'",
+            "Example: 'Please provide your preferred payment method.'",
+            "Responses must be natural, never robotic or verbose.",
+            "Tone: short, crisp, professional, and user-friendly. If a specific brand or persona is set, match that style.",
+        ],
+        show_tool_calls=True,
+        markdown=True,
+        add_state_in_messages=not STABLE_PROMPTS,
+    )
 
 # --- Orchestrator Team ---
-orchestrator_team = Team(
-    name="Orchestrator Team",
-    mode="route",
-    model=OpenAIChat("gpt-4o"),
-    members=[user_profile_agent, shopping_agent, coffee_agent],
-    show_tool_calls=True,
-    markdown=True,
-    show_members_responses=True,
-    instructions=[
-        "You are an orchestrator that routes user requests to the appropriate agent.",
-        "If the request is about preferences, address, or payment, route to the user profile agent.",
-        "If the request is about shopping (clothes, fashion, etc.), route to the shopping agent.",
-        "If the request is about coffee or drinks, route to the coffee agent.",
-        "The user_id argument is always provided by the system and is the user's email (e.g., priya@example.com). Never ask the user for their email or user_id.",
-        "Preferences are global and managed by the user profile agent.",
-        "Current User ID: {current_user_id}",
-        "Current Session ID: {current_session_id}",
-    ],
-    add_state_in_messages=True,
-)
+@lru_cache(maxsize=None)
+def get_orchestrator_team() -> "Team":
+    from agno.team.team import Team
+
+    init_db()
+    return Team(
+        name="Orchestrator Team",
+        mode="route",
+        model=get_model(),
+        members=[get_user_profile_agent(), get_shopping_agent(), get_coffee_agent()],
+        show_tool_calls=True,
+        markdown=True,
+        show_members_responses=True,
+        instructions=_instructions([
+            "You are an orchestrator that routes user requests to the appropriate agent.",
+            "If the request is about preferences, address, or payment, route to the user profile agent.",
+            "If the request is about shopping (clothes, fashion, etc.), route to the shopping agent.",
+            "If the request is about coffee or drinks, route to the coffee agent.",
+            "The user_id argument is always provided by the system and is the user's email (e.g., priya@example.com). Never ask the user for their email or user_id.",
+            "Preferences are global and managed by the user profile agent.",
+            "Current User ID: {current_user_id}",
+            "Current Session ID: {current_session_id}",
+        ]),
+        add_state_in_messages=not STABLE_PROMPTS,
+    )
+
+# --- Fast-Path Router ---
+# Most messages are unambiguous ("a large latte", "ship to 12 Oak St"); sending those
+# straight to the member agent skips the orchestrator's gpt-4o routing call. Anything the
+# keyword router is not confident about still goes through the Team.
+ROUTING_RULES = {
+    "user_profile": {
+        r"address|ship(?:ping)? to|deliver(?:y)? to|zip": 3.0,
+        r"payment|card|amex|visa|mastercard|pay with": 3.0,
+        r"preference|prefer|concierge style|tone|no calls": 3.0,
+        r"update|change": 0.5,
+    },
+    "shopping": {
+        r"jeans|dress|hoodie|sneakers|shoes|shirt|jacket|clothes|fashion|outfit": 3.0,
+        r"waist|inseam|size|travel(?:ing|ling)?|trip|vacation": 3.0,
+        r"cart|checkout|in stock|out of stock|recommend|order status|order history": 2.0,
+        r"levi'?s|nike|zara|uniqlo|adidas": 2.0,
+        r"buy|order|purchase": 1.0,
+    },
+    "coffee": {
+        r"coffee|latte|espresso|cappuccino|cold brew|americano|mocha|flat white": 3.0,
+        r"drink|caffeine|brew": 2.0,
+    },
+}
+ROUTE_TARGETS = {
+    "user_profile": get_user_profile_agent,
+    "shopping": get_shopping_agent,
+    "coffee": get_coffee_agent,
+}
+router = KeywordRouter(ROUTING_RULES, threshold=float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.75")))
+ROUTER_ENABLED = os.getenv("ROUTER_ENABLED", "1") == "1"
+
+def route_message(message: str, user_id: str, session_id: str, print_response: bool = False, **kwargs):
+    """Send one user turn to the right agent or the team.
+
+    Not safe to call from several threads at once: the agents and the team are cached per
+    process and agno keeps per-run state on them, so concurrent runs overwrite each other.
+    Serve one turn at a time per process, or give each thread its own instances as
+    benchmarks/bench_load.py does.
+    """
+    decision = router.route(message) if ROUTER_ENABLED else RouteDecision(None, 0.0, {})
+    if decision.member == "shopping" and TOOL_GATING_ENABLED:
+        selection = shopping_tool_gate.select(message, slot_cache.peek((user_id, session_id)))
+        target = get_shopping_agent(selection.groups) if selection.saved_tokens else get_shopping_agent()
+    elif decision.member:
+        target = ROUTE_TARGETS[decision.member]()
+    else:
+        target = get_orchestrator_team()
+    respond = target.print_response if print_response else target.run
+    if STABLE_PROMPTS:
+        message = with_context(message, request_context(user_id, session_id))
+    start = time.perf_counter()
+    response = respond(message, user_id=user_id, session_id=session_id, **kwargs)
+    router.stats.record(hit=decision.member is not None, seconds=time.perf_counter() - start)
+    if SLOT_CACHE_ENABLED:
+        slot_cache.flush((user_id, session_id))
+    return response
+
+_LAZY_ATTRIBUTES = {
+    "memory": get_memory,
+    "shopping_agent": get_shopping_agent,
+    "coffee_agent": get_coffee_agent,
+    "user_profile_agent": get_user_profile_agent,
+    "orchestrator_team": get_orchestrator_team,
+}
+
+def __getattr__(name: str):
+    # Keeps `from base import shopping_agent` (and friends) working without building
+    # every agent at import time.
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- Example Usage ---
 if __name__ == "__main__":
@@ -700,6 +1328,10 @@ if __name__ == "__main__":
     while True:
         user_input = input("You: ")
         if user_input.strip().lower() in {"exit", "quit"}:
+            print(f"Router: {router.stats.report()}")
+            print(f"Tool gating: {shopping_tool_gate.stats.report()}")
+            slot_cache.stop()
+            get_memory().extraction_queue.stop()
             print("Goodbye!")
             break
-        orchestrator_team.print_response(user_input, user_id=user_id, session_id=session_id)
+        route_message(user_input, user_id=user_id, session_id=session_id, print_response=True)
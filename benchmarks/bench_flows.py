@@ -0,0 +1,233 @@
+"""Per-turn cost of the concierge flows from main.py, offline, at growing data sizes.
+
+Swaps the agents' model for benchmarks/scripted_model.ScriptedModel, which replays canned
+tool calls for the profile setup, travel-aware order, duplicate order and tone flows, and
+drives them through route_message against a throwaway database holding --sizes products,
+users and orders each. For every turn it reports median wall time and tool time over
+--repeat fresh users, shopping.db queries, tool calls and the tracemalloc peak.
+
+    python benchmarks/bench_flows.py --sizes 1000,10000,100000,1000000
+    python benchmarks/bench_flows.py --sizes 1000,10000 --save baseline.json
+    python benchmarks/bench_flows.py --sizes 1000,10000 --compare baseline.json
+
+--compare exits non-zero if a turn got slower or allocated more than --tolerance allows,
+or if its query or tool-call count went up (those are exact, so any increase counts).
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+BRANDS = [f"Brand{i}" for i in range(500)]
+COLORS = ["black", "white", "blue", "red", "green", "grey", "beige", "navy", "brown", "pink"]
+STYLES = ["casual", "formal", "sporty", "streetwear", "outdoor", "lounge"]
+SEED_BATCH = 100_000
+# Exact counters: any increase is a regression.
+EXACT_METRICS = ("queries", "tool_calls")
+TIMED_METRICS = ("wall_ms", "alloc_kib")
+
+
+def write_catalog(path: str, base_products, size: int, rng: random.Random) -> None:
+    # The flows order p1/p3/p4, so the demo products stay in (stocked for every repeat,
+    # or later runs would measure the out-of-stock path) and the rest is synthetic.
+    with open(path, "w", encoding="utf-8") as f:
+        for product in base_products:
+            f.write(json.dumps(dict(product, stock=10_000) if product["stock"] else product) + "\n")
+        for i in range(len(base_products) + 1, size + 1):
+            f.write(json.dumps({
+                "id": f"p{i}",
+                "name": f"Item {i}",
+                "brand": rng.choice(BRANDS),
+                "color": rng.choice(COLORS),
+                "style": rng.choice(STYLES),
+                "price": round(rng.uniform(10, 500), 2),
+                "stock": rng.randint(1, 50),
+            }) + "\n")
+
+
+def populate(base, size: int, rng: random.Random) -> None:
+    from sqlalchemy import insert
+
+    with base.engine.begin() as conn:
+        for start in range(0, size, SEED_BATCH):
+            ids = range(start + 1, min(start + SEED_BATCH, size) + 1)
+            conn.execute(insert(base.User), [{"email": f"user{i}@example.com"} for i in ids])
+            conn.execute(
+                insert(base.Order),
+                [{"id": i, "user_id": rng.randint(1, size), "address": "1 Seed St", "status": "Delivered"} for i in ids],
+            )
+            conn.execute(
+                insert(base.OrderItem),
+                [{"order_id": i, "product_id": f"p{rng.randint(6, max(6, size))}", "quantity": 1} for i in ids],
+            )
+
+
+def run_flows(base, flows, user_id: str, session_id: str, on_turn) -> None:
+    for flow, messages in flows.items():
+        for turn, message in enumerate(messages, 1):
+            on_turn(flow, turn, message, lambda: base.route_message(message, user_id=user_id, session_id=session_id))
+            # Deferred memory extraction is off the turn's path; drain it outside the timing.
+            base.get_memory().extraction_queue.flush()
+
+
+def measure(size: int, repeat: int, tmp: str) -> list:
+    """Run in a fresh process per size: CATALOG_PATH and the engine are read at import."""
+    from sqlalchemy import event
+
+    rng = random.Random(42)
+    os.chdir(tmp)
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ["SHOPPING_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'shopping.db')}"
+    os.environ["CATALOG_PATH"] = os.path.join(tmp, "catalog.jsonl")
+    # Keep the background sweeper out of the query counts.
+    os.environ["RESERVATION_SWEEP_INTERVAL_SECONDS"] = "3600"
+
+    import base
+    from scripted_model import CONCIERGE_SCRIPTS, FLOWS, ScriptedModel
+
+    write_catalog(os.environ["CATALOG_PATH"], base.PRODUCTS, size, rng)
+    models = []
+
+    def scripted_model():
+        models.append(ScriptedModel(scripts=CONCIERGE_SCRIPTS))
+        return models[-1]
+
+    base.get_model = scripted_model
+    start = time.perf_counter()
+    base.init_db()
+    populate(base, size, rng)
+    base.ensure_inventory()
+    base.product_search_index.sync()
+    print(f"[{size:,}] seeded in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    queries = [0]
+
+    @event.listens_for(base.engine, "before_cursor_execute")
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        queries[0] += 1
+
+    samples = {}
+
+    def timed(flow, turn, message, call):
+        before = queries[0]
+        start = time.perf_counter()
+        response = call()
+        wall = (time.perf_counter() - start) * 1000
+        tools = response.tools or []
+        row = samples.setdefault((flow, turn), {"message": message, "wall_ms": [], "tool_ms": [], "queries": [], "tool_calls": []})
+        row["wall_ms"].append(wall)
+        row["tool_ms"].append(sum((t.metrics.time or 0) for t in tools if t.metrics) * 1000)
+        row["queries"].append(queries[0] - before)
+        row["tool_calls"].append(len(tools))
+
+    # Warm-up builds the agents for every tool subset the flows hit.
+    run_flows(base, FLOWS, "warmup@example.com", "warmup_session", lambda flow, turn, message, call: call())
+    for r in range(repeat):
+        run_flows(base, FLOWS, f"bench{r}@example.com", f"bench{r}_session", timed)
+
+    # Allocations on a separate pass: tracemalloc slows everything down.
+    tracemalloc.start()
+
+    def traced(flow, turn, message, call):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        call()
+        samples[(flow, turn)]["alloc_kib"] = (tracemalloc.get_traced_memory()[1] - before) / 1024
+
+    run_flows(base, FLOWS, "traced@example.com", "traced_session", traced)
+    tracemalloc.stop()
+    base.slot_cache.stop()
+    base.get_memory().extraction_queue.stop()
+
+    missing = sum(m.missing_tools for m in models)
+    if missing:
+        print(f"[{size:,}] {missing} scripted steps were skipped: their tools were not offered", file=sys.stderr)
+    return [
+        {
+            "size": size,
+            "flow": flow,
+            "turn": turn,
+            "message": row["message"],
+            "wall_ms": statistics.median(row["wall_ms"]),
+            "tool_ms": statistics.median(row["tool_ms"]),
+            "queries": statistics.median(row["queries"]),
+            "tool_calls": statistics.median(row["tool_calls"]),
+            "alloc_kib": row["alloc_kib"],
+        }
+        for (flow, turn), row in samples.items()
+    ]
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    previous = {(r["size"], r["flow"], r["turn"]): r for r in baseline}
+    regressions = []
+    for row in results:
+        old = previous.get((row["size"], row["flow"], row["turn"]))
+        if old is None:
+            continue
+        label = f"{row['size']:,} {row['flow']} #{row['turn']}"
+        for metric in EXACT_METRICS:
+            if row[metric] > old[metric]:
+                regressions.append(f"{label}: {metric} {old[metric]:g} -> {row[metric]:g}")
+        for metric in TIMED_METRICS:
+            if row[metric] > old[metric] * (1 + tolerance):
+                regressions.append(f"{label}: {metric} {old[metric]:.1f} -> {row[metric]:.1f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="comma-separated products/users/orders")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh users per size; medians are reported")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from --save")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed wall/alloc growth vs the baseline")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_size:
+        with tempfile.TemporaryDirectory() as tmp:
+            print(json.dumps(measure(args.run_size, args.repeat, tmp)))
+        return 0
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        out = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-size", str(size), "--repeat", str(args.repeat)],
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True,
+        ).stdout
+        results.extend(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"{'size':>9}  {'flow':<20}{'#':>2}  {'wall ms':>8}{'tool ms':>9}{'queries':>9}{'tools':>7}{'alloc KiB':>11}")
+    for row in results:
+        print(
+            f"{row['size']:>9,}  {row['flow']:<20}{row['turn']:>2}  {row['wall_ms']:>8.2f}{row['tool_ms']:>9.2f}"
+            f"{row['queries']:>9g}{row['tool_calls']:>7g}{row['alloc_kib']:>11.0f}"
+        )
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Cold-start cost of `import base`, measured with `python -X importtime` in fresh interpreters.
+
+Also times building the orchestrator team afterwards, which is the work import used to do
+eagerly and now only happens in processes that call the get_*() factories.
+
+    python benchmarks/bench_import.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_profile(code: str, cwd: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "bench"))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = [f.strip() for f in line[len("import time:"):].split("|")]
+        if not fields[0].isdigit():
+            continue
+        modules[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    timings = [float(v) for v in proc.stdout.split()]
+    return {"modules": modules, "timings": timings}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="heaviest modules to list")
+    args = parser.parse_args()
+
+    import_code = "import time; t = time.perf_counter(); import base; print(time.perf_counter() - t)"
+    team_code = (
+        "import base, time; t = time.perf_counter(); base.get_orchestrator_team(); print(time.perf_counter() - t)"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        runs = [import_profile(import_code, tmp) for _ in range(args.runs)]
+        team_runs = [import_profile(team_code, tmp) for _ in range(args.runs)]
+
+    base_us = [r["modules"]["base"][1] for r in runs]
+    import_s = [r["timings"][0] for r in runs]
+    team_s = [r["timings"][0] for r in team_runs]
+    print(f"import base (importtime cumulative): median {statistics.median(base_us) / 1000:.1f} ms over {args.runs} runs")
+    print(f"import base (wall):                  median {statistics.median(import_s) * 1000:.1f} ms")
+    print(f"get_orchestrator_team() afterwards:  median {statistics.median(team_s) * 1000:.1f} ms")
+    print("\nheaviest modules imported by `import base` (self time, last run):")
+    last = runs[-1]["modules"]
+    for name, (self_us, _) in sorted(last.items(), key=lambda kv: kv[1][0], reverse=True)[: args.top]:
+        print(f"  {self_us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Hot-path lookup latency on a large shopping.db before and after the user_id/lookup indexes.
+
+Builds a throwaway database with --rows rows in each per-user table (addresses, being
+unique per user, get one row per user), drops the secondary indexes to mimic a database
+created before they existed, times the lookups, then runs db.ensure_indexes() (the
+migration path for existing files) and times them again.
+
+    python benchmarks/bench_indexes.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def populate(engine, base, rows: int, users: int) -> None:
+    from sqlalchemy import insert
+
+    rng = random.Random(42)
+    batch = 100_000
+    with engine.begin() as conn:
+        conn.execute(insert(base.User), [{"email": f"user{i}@example.com"} for i in range(1, users + 1)])
+        # Addresses and preferences are unique per user and per (user, key): one address per
+        # user, and preference rows cycle through the users before moving to the next key.
+        conn.execute(insert(base.Address), [{"user_id": u, "address": "123 Main St"} for u in range(1, users + 1)])
+        for start in range(0, rows, batch):
+            n = min(batch, rows - start)
+            uids = [rng.randint(1, users) for _ in range(n)]
+            conn.execute(
+                insert(base.Preference),
+                [{"user_id": i % users + 1, "key": f"k{i // users}", "value": "v"} for i in range(start, start + n)],
+            )
+            conn.execute(insert(base.Cart), [{"user_id": u, "product_id": f"p{rng.randint(1, 5000)}", "quantity": 1} for u in uids])
+            conn.execute(insert(base.Order), [{"user_id": u, "address": "123 Main St", "status": "Processing"} for u in uids])
+            conn.execute(
+                insert(base.OrderItem),
+                [{"order_id": rng.randint(1, start + n), "product_id": f"p{rng.randint(1, 5000)}", "quantity": 1} for _ in range(n)],
+            )
+
+
+def time_lookups(engine, users: int, rows: int, repeat: int) -> dict:
+    rng = random.Random(7)
+    queries = {
+        "addresses by user_id": ("SELECT * FROM addresses WHERE user_id = ?", lambda: (rng.randint(1, users),)),
+        "preferences by (user_id, key)": ("SELECT value FROM preferences WHERE user_id = ? AND key = ?", lambda: (rng.randint(1, users), f"k{rng.randint(0, (rows - 1) // users)}")),
+        "carts by (user_id, product_id)": ("SELECT * FROM carts WHERE user_id = ? AND product_id = ?", lambda: (rng.randint(1, users), f"p{rng.randint(1, 5000)}")),
+        "latest orders by user_id": ("SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC, id DESC LIMIT 11", lambda: (rng.randint(1, users),)),
+        "order_items by order_id": ("SELECT * FROM order_items WHERE order_id = ?", lambda: (rng.randint(1, rows),)),
+        "order_items by product_id": ("SELECT order_id FROM order_items WHERE product_id = ?", lambda: (f"p{rng.randint(1, 5000)}",)),
+    }
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, params) in queries.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.exec_driver_sql(sql, params()).fetchall()
+            results[name] = (time.perf_counter() - start) / repeat * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--repeat", type=int, default=20, help="lookups per query shape")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ["SHOPPING_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        import base
+        from db import ensure_indexes
+
+        base.init_db()
+
+        engine = base.engine
+        print(f"populating {args.rows:,} rows per table for {args.users:,} users...")
+        populate(engine, base, args.rows, args.users)
+        with engine.begin() as conn:
+            for table in base.Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+
+        before = time_lookups(engine, args.users, args.rows, args.repeat)
+        start = time.perf_counter()
+        created = ensure_indexes(engine, base.Base.metadata)
+        migration_s = time.perf_counter() - start
+        after = time_lookups(engine, args.users, args.rows, args.repeat)
+
+        print(f"ensure_indexes created {len(created)} indexes in {migration_s:.1f}s")
+        print(f"{'query':<32}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+        for name in before:
+            print(f"{name:<32}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / after[name]:>9.0f}x")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
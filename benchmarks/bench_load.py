@@ -0,0 +1,219 @@
+"""Concurrent multi-user load on the orchestrator team, offline, at rising concurrency.
+
+Each level starts --concurrency simulated users at once, one thread per user, each with its
+own user_id/session_id, and runs main.py's scripted conversation (see scripted_model.FLOWS)
+against route_message with benchmarks/scripted_model.ScriptedModel standing in for gpt-4o.
+By default the fast-path router is off so every turn goes through the orchestrator team
+(--entry router keeps it on). All users share one shopping.db and one memory.db, but
+each gets its own agents and team: route_message is not thread-safe on base's shared
+cached instances, whose per-run state concurrent runs would overwrite.
+
+Per level it reports throughput, p50/p95/p99 turn latency, error rate and SQLite lock
+contention: shopping.db lock waits (BEGIN calls slower than --lock-wait-ms, and
+their total time) and "database is locked"/busy errors on either database.
+
+    python benchmarks/bench_load.py --concurrency 1,10,50,100,500
+"""
+import argparse
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+
+class LockStats:
+    """Counts shopping.db lock waits and locked/busy errors on any engine it watches."""
+
+    def __init__(self, wait_threshold_ms: float):
+        self.wait_threshold = wait_threshold_ms / 1000
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.waits = 0
+            self.wait_seconds = 0.0
+            self.errors = Counter()
+
+    def watch(self, engine, name: str) -> None:
+        from sqlalchemy import event
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("BEGIN"):
+                conn.info["begin_started"] = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info.pop("begin_started", None)
+            if started is not None:
+                waited = time.perf_counter() - started
+                if waited >= self.wait_threshold:
+                    with self._lock:
+                        self.waits += 1
+                        self.wait_seconds += waited
+
+        @event.listens_for(engine, "handle_error")
+        def _error(context):
+            message = str(context.original_exception).lower()
+            if "locked" in message or "busy" in message:
+                with self._lock:
+                    self.errors[name] += 1
+
+
+AGENT_FACTORIES = ("get_shopping_agent", "get_user_profile_agent", "get_coffee_agent", "get_orchestrator_team")
+
+
+def per_thread_agents(base) -> None:
+    """Make base's agent and team factories cache per thread instead of per process."""
+    local = threading.local()
+
+    def scoped(factory):
+        build = factory.__wrapped__
+
+        def get(*args):
+            built = local.__dict__.setdefault(factory.__name__, {})
+            if args not in built:
+                built[args] = build(*args)
+            return built[args]
+
+        get.__name__ = factory.__name__
+        get.cache_clear = factory.cache_clear
+        return get
+
+    for name in AGENT_FACTORIES:
+        setattr(base, name, scoped(getattr(base, name)))
+    # route_message reaches the member agents through this table, not the module globals.
+    for member, factory in base.ROUTE_TARGETS.items():
+        base.ROUTE_TARGETS[member] = getattr(base, factory.__name__)
+
+
+def percentile(quantiles: list, p: int) -> float:
+    return quantiles[p - 1] if quantiles else 0.0
+
+
+def run_level(base, flows, level: int, users: int, locks: LockStats) -> dict:
+    messages = [message for turns in flows.values() for message in turns]
+    latencies, errors = [], Counter()
+    lock = threading.Lock()
+    # The clock (and lock accounting) starts once every user has built its agents.
+    started = []
+
+    def go() -> None:
+        locks.reset()
+        started.append(time.perf_counter())
+
+    start_line = threading.Barrier(users, action=go)
+
+    def user(n: int) -> None:
+        user_id, session_id = f"load{level}_{n}@example.com", f"load{level}_{n}_session"
+        # This user's thread builds its own team and agents before the clock starts.
+        base.get_orchestrator_team()
+        for factory in base.ROUTE_TARGETS.values():
+            factory()
+        start_line.wait()
+        for message in messages:
+            start = time.perf_counter()
+            try:
+                base.route_message(message, user_id=user_id, session_id=session_id)
+            except Exception as e:
+                frame = traceback.extract_tb(e.__traceback__)[-1]
+                with lock:
+                    errors[f"{type(e).__name__} at {os.path.basename(frame.filename)}:{frame.lineno}"] += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        futures = [pool.submit(user, n) for n in range(users)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started[0]
+
+    turns = users * len(messages)
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "users": users,
+        "turns": turns,
+        "turns_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(quantiles, 50),
+        "p95_ms": percentile(quantiles, 95),
+        "p99_ms": percentile(quantiles, 99),
+        "error_rate": sum(errors.values()) / turns,
+        "errors": dict(errors),
+        "lock_waits": locks.waits,
+        "lock_wait_s": locks.wait_seconds,
+        "locked_errors": dict(locks.errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,10,50,100,500", help="comma-separated simultaneous users per level")
+    parser.add_argument("--entry", choices=("team", "router"), default="team", help="send every turn to the team, or let the fast-path router pick")
+    parser.add_argument("--size", type=int, default=10_000, help="products, users and orders seeded before the run")
+    parser.add_argument("--lock-wait-ms", type=float, default=5.0, help="BEGIN slower than this counts as a lock wait")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.environ.setdefault("OPENAI_API_KEY", "offline")
+        os.environ["SHOPPING_DB_URL"] = f"sqlite:///{os.path.join(tmp, 'shopping.db')}"
+        os.environ["CATALOG_PATH"] = os.path.join(tmp, "catalog.jsonl")
+
+        import base
+        from bench_flows import populate, write_catalog
+        from scripted_model import CONCIERGE_ROUTES, CONCIERGE_SCRIPTS, DEFAULT_MEMBER, FLOWS, ScriptedModel
+
+        rng = random.Random(42)
+        write_catalog(os.environ["CATALOG_PATH"], base.PRODUCTS, args.size, rng)
+        base.get_model = lambda: ScriptedModel(scripts=CONCIERGE_SCRIPTS, routes=CONCIERGE_ROUTES, default_member=DEFAULT_MEMBER)
+        base.ROUTER_ENABLED = args.entry == "router"
+        base.init_db()
+        per_thread_agents(base)
+        populate(base, args.size, rng)
+        base.ensure_inventory()
+        base.product_search_index.sync()
+
+        # The profile and coffee agents warn on every run that they have no memory db, and
+        # agno resets its log level on every run, so filter rather than setLevel.
+        for name in ("agno", "agno-team"):
+            logging.getLogger(name).addFilter(lambda record: record.levelno >= logging.ERROR)
+
+        locks = LockStats(args.lock_wait_ms)
+        locks.watch(base.engine, "shopping.db")
+        locks.watch(base.get_memory().db.db_engine, "memory.db")
+        # One warm-up conversation loads the lazy imports, tool schemas and shared caches
+        # before the clock starts.
+        run_level(base, FLOWS, 0, 1, locks)
+
+        print(
+            f"{'users':>6}{'turns':>7}{'turns/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'err %':>7}{'lock waits':>12}{'wait s':>8}  locked errors / errors"
+        )
+        for level, users in enumerate((int(c) for c in args.concurrency.split(",")), 1):
+            r = run_level(base, FLOWS, level, users, locks)
+            print(
+                f"{r['users']:>6}{r['turns']:>7}{r['turns_per_s']:>9.1f}{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}"
+                f"{r['p99_ms']:>9.0f}{r['error_rate'] * 100:>7.1f}{r['lock_waits']:>12}{r['lock_wait_s']:>8.2f}"
+                f"  {r['locked_errors'] or '-'} / {r['errors'] or '-'}",
+                flush=True,
+            )
+        base.slot_cache.stop()
+        base.get_memory().extraction_queue.stop()
+
+
+if __name__ == "__main__":
+    main()
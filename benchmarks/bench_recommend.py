@@ -0,0 +1,91 @@
+"""Latency of the vectorized Recommender vs the old first-matches OR filter on a large catalog.
+
+Generates a synthetic catalog of --skus products (about 5% out of stock), then times
+Recommender.recommend() for random profiles with and without purchase history.
+
+    python benchmarks/bench_recommend.py --skus 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy  # noqa: F401  (imported up front so the encode timing below excludes it)
+
+from catalog import Catalog
+from recommend import Recommender
+
+BRANDS = [f"Brand{i}" for i in range(500)]
+COLORS = ["black", "white", "blue", "red", "green", "grey", "beige", "navy", "brown", "pink"]
+STYLES = ["casual", "formal", "sporty", "streetwear", "outdoor", "lounge"]
+
+
+def synthetic_products(skus: int, rng: random.Random):
+    for i in range(skus):
+        yield {
+            "id": f"p{i}",
+            "name": f"Item {i}",
+            "brand": rng.choice(BRANDS),
+            "color": rng.choice(COLORS),
+            "style": rng.choice(STYLES),
+            "price": round(rng.uniform(10, 500), 2),
+            "stock": 0 if rng.random() < 0.05 else rng.randint(1, 50),
+        }
+
+
+def time_calls(fn, profiles, repeat: int) -> list:
+    timings = []
+    for i in range(repeat):
+        profile = profiles[i % len(profiles)]
+        start = time.perf_counter()
+        fn(profile)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--skus", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    start = time.perf_counter()
+    catalog = Catalog(synthetic_products(args.skus, rng))
+    len(catalog)
+    print(f"built {args.skus:,}-SKU catalog in {time.perf_counter() - start:.1f}s")
+
+    recommender = Recommender(catalog)
+    start = time.perf_counter()
+    recommender.features
+    print(f"encoded features in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    profiles = [
+        {
+            "brands": rng.sample(BRANDS, 2),
+            "colors": rng.sample(COLORS, 2),
+            "styles": rng.sample(STYLES, 1),
+            "purchased": [f"p{rng.randrange(args.skus)}" for _ in range(20)],
+        }
+        for _ in range(20)
+    ]
+    cases = {
+        "match_any (old, unscored)": lambda p: catalog.match_any(p["brands"], p["colors"], p["styles"], limit=args.limit),
+        "recommend, profile only": lambda p: recommender.recommend(p["brands"], p["colors"], p["styles"], limit=args.limit),
+        "recommend, profile + history": lambda p: recommender.recommend(
+            p["brands"], p["colors"], p["styles"], purchased=p["purchased"], limit=args.limit
+        ),
+    }
+    print(f"{'case':<32}{'p50 ms':>10}{'max ms':>10}")
+    for name, fn in cases.items():
+        timings = time_calls(fn, profiles, args.repeat)
+        print(f"{name:<32}{statistics.median(timings):>10.2f}{max(timings):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
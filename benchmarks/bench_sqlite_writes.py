@@ -0,0 +1,111 @@
+"""Concurrent write throughput of the default SQLAlchemy SQLite engine vs db.create_sqlite_engine.
+
+Each worker thread runs add_to_cart-shaped transactions (look up the user, upsert a cart
+line, commit) against a fresh database file. The tuned engine is wrapped in db.writer(),
+as the app's write sessions are, so these read-then-write transactions begin IMMEDIATE.
+A transaction that fails (e.g. "database is locked") counts against its config, and the
+run exits non-zero if any config lost one.
+
+    python benchmarks/bench_sqlite_writes.py --threads 16 --ops 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table, create_engine, insert, select, update
+from sqlalchemy.exc import OperationalError
+
+from db import create_sqlite_engine, writer
+
+metadata = MetaData()
+users = Table("users", metadata, Column("id", Integer, primary_key=True), Column("email", String, unique=True))
+carts = Table(
+    "carts",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, ForeignKey("users.id")),
+    Column("product_id", String),
+    Column("quantity", Integer),
+)
+
+
+def run(engine, threads: int, ops: int) -> dict:
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(users), [{"email": f"user{i}@example.com"} for i in range(threads)])
+    errors = []
+    committed = [0]
+    lock = threading.Lock()
+
+    def worker(n: int):
+        email = f"user{n}@example.com"
+        for i in range(ops):
+            product_id = f"p{i % 20}"
+            try:
+                with engine.begin() as conn:
+                    user_id = conn.execute(select(users.c.id).where(users.c.email == email)).scalar_one()
+                    row = conn.execute(
+                        select(carts.c.id).where(carts.c.user_id == user_id, carts.c.product_id == product_id)
+                    ).first()
+                    if row:
+                        conn.execute(update(carts).where(carts.c.id == row.id).values(quantity=carts.c.quantity + 1))
+                    else:
+                        conn.execute(insert(carts).values(user_id=user_id, product_id=product_id, quantity=1))
+                with lock:
+                    committed[0] += 1
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e.orig))
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+    return {
+        "attempted": threads * ops,
+        "committed": committed[0],
+        "errors": len(errors),
+        "seconds": elapsed,
+        "tx_per_s": committed[0] / elapsed,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="transactions per thread")
+    args = parser.parse_args()
+
+    failed = []
+    with tempfile.TemporaryDirectory() as tmp:
+        configs = {
+            "default": lambda url: create_engine(url),
+            "tuned": lambda url: writer(create_sqlite_engine(url)),
+        }
+        print(f"{args.threads} threads x {args.ops} transactions")
+        for name, factory in configs.items():
+            url = f"sqlite:///{os.path.join(tmp, name + '.db')}"
+            result = run(factory(url), args.threads, args.ops)
+            print(
+                f"{name:>8}: {result['tx_per_s']:8.1f} committed tx/s  "
+                f"failed={result['errors']}/{result['attempted']} ({result['errors'] / result['attempted']:.1%})"
+                f"  wall={result['seconds']:.2f}s"
+            )
+            if result["errors"]:
+                failed.append(name)
+    for name in failed:
+        print(f"FAIL {name}: transactions failed, so its tx/s is not comparable")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
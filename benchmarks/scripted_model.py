@@ -0,0 +1,179 @@
+"""A local stand-in for OpenAIChat that replays canned tool-call sequences.
+
+ScriptedModel matches the latest user message against a list of Scripts and answers with
+each step's tool calls in turn, then with the script's reply, so agents, tools, memory and
+the database run for real while the model costs nothing and always behaves the same way.
+Messages no script covers (including agno's memory-extraction prompts) get a plain reply.
+Offered a route-mode Team's forward_task_to_member, it forwards to the member whose `routes`
+pattern matches, or to `default_member`.
+
+    base.get_model = lambda: ScriptedModel(CONCIERGE_SCRIPTS)
+"""
+import itertools
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from agno.models.base import Model
+from agno.models.response import ModelResponse
+
+_USER_ID = re.compile(r"Current User ID: (\S+)")
+
+
+class ToolCall(NamedTuple):
+    name: str
+    # String values may use {user_id}; it is filled from the request context in the prompt.
+    args: Dict[str, Any] = {}
+
+
+class Script(NamedTuple):
+    pattern: str
+    # Each step is sent as one assistant message; its calls run before the next step.
+    steps: Sequence[Sequence[ToolCall]]
+    reply: str
+    # (tool name, result, reply): end the turn early when that tool returns that result.
+    stop_on: Optional[Tuple[str, str, str]] = None
+
+
+def _fill(value, user_id: str):
+    if isinstance(value, str):
+        return value.replace("{user_id}", user_id)
+    if isinstance(value, dict):
+        return {k: _fill(v, user_id) for k, v in value.items()}
+    return value
+
+
+@dataclass
+class ScriptedModel(Model):
+    id: str = "scripted"
+    name: str = "ScriptedModel"
+    provider: str = "local"
+    scripts: Sequence[Script] = ()
+    default_reply: str = "Noted."
+    # (pattern, member_id) for route-mode teams, first match wins.
+    routes: Sequence[Tuple[str, str]] = ()
+    default_member: Optional[str] = None
+    # Steps skipped because the agent did not offer their tools (e.g. gated out).
+    missing_tools: int = 0
+    _call_ids: Any = field(default_factory=itertools.count, repr=False)
+
+    def _respond(self, messages: List, tools: Optional[List[Dict[str, Any]]]) -> ModelResponse:
+        offered = {(t.get("function") or t).get("name") for t in tools or []}
+        last_user = max((i for i, m in enumerate(messages) if m.role == "user"), default=-1)
+        text = messages[last_user].get_content_string() if last_user >= 0 else ""
+        turn = messages[last_user + 1:]
+        if "forward_task_to_member" in offered and not turn:
+            member = next((m for pattern, m in self.routes if re.search(pattern, text, re.IGNORECASE)), self.default_member)
+            if member:
+                return self._tool_calls([ToolCall("forward_task_to_member", {"member_id": member})], "")
+        script = next(
+            (
+                s for s in self.scripts
+                if re.search(s.pattern, text, re.IGNORECASE) and {c.name for c in s.steps[0]} <= offered
+            ),
+            None,
+        )
+        if script is None:
+            return ModelResponse(role="assistant", content=self.default_reply)
+
+        done = sum(1 for m in turn if m.role == "assistant" and m.tool_calls)
+        if script.stop_on and done:
+            tool_name, result, reply = script.stop_on
+            if any(m.role == "tool" and m.tool_name == tool_name and m.get_content_string() == result for m in turn):
+                return ModelResponse(role="assistant", content=reply)
+        if done >= len(script.steps):
+            return ModelResponse(role="assistant", content=script.reply)
+        step = script.steps[done]
+        if not {c.name for c in step} <= offered:
+            self.missing_tools += 1
+            return ModelResponse(role="assistant", content=script.reply)
+
+        found = next((_USER_ID.search(m.get_content_string()) for m in messages if m.content and _USER_ID.search(m.get_content_string())), None)
+        return self._tool_calls(step, found.group(1) if found else "")
+
+    def _tool_calls(self, calls: Sequence[ToolCall], user_id: str) -> ModelResponse:
+        return ModelResponse(
+            role="assistant",
+            tool_calls=[
+                {
+                    "id": f"call_{next(self._call_ids)}",
+                    "type": "function",
+                    "function": {"name": call.name, "arguments": json.dumps(_fill(call.args, user_id))},
+                }
+                for call in calls
+            ],
+        )
+
+    def invoke(self, messages: List, tools: Optional[List[Dict[str, Any]]] = None, **kwargs) -> ModelResponse:
+        return self._respond(messages, tools)
+
+    async def ainvoke(self, messages: List, tools: Optional[List[Dict[str, Any]]] = None, **kwargs) -> ModelResponse:
+        return self._respond(messages, tools)
+
+    def invoke_stream(self, messages: List, tools: Optional[List[Dict[str, Any]]] = None, **kwargs) -> Iterator[ModelResponse]:
+        yield self._respond(messages, tools)
+
+    async def ainvoke_stream(self, messages: List, tools: Optional[List[Dict[str, Any]]] = None, **kwargs):
+        yield self._respond(messages, tools)
+
+    def parse_provider_response(self, response: ModelResponse, **kwargs) -> ModelResponse:
+        return response
+
+    def parse_provider_response_delta(self, response: ModelResponse) -> ModelResponse:
+        return response
+
+
+# --- Concierge Flows ---
+# The conversation from main.py's __main__, in order, one list of messages per flow.
+FLOWS = {
+    "profile setup": [
+        "My waist size is 32.",
+        "My address is 123 Main St, Springfield, 90210.",
+        "Set my payment method to Amex ending 1234.",
+        "Set my preference: no calls, only text.",
+        "I'm traveling to Paris.",
+    ],
+    "travel-aware order": ["Order a green hoodie for me"],
+    "duplicate order": ["Order a blue jeans for me", "Order a blue jeans for me"],
+    "tone": ["Set my concierge style to friendly.", "Order a black dress for me"],
+}
+
+
+def _profile(pattern: str, reply: str, **fields) -> Script:
+    return Script(pattern, [[ToolCall("update_profile", {"user_id": "{user_id}", **fields})]], reply)
+
+
+def _order(pattern: str, query: str, product_id: str, reply: str) -> Script:
+    return Script(
+        pattern,
+        [
+            [ToolCall("get_user_context", {"user_id": "{user_id}"})],
+            [ToolCall("search_products", {"query": query, "in_stock_only": True})],
+            [ToolCall("is_duplicate_order", {"user_id": "{user_id}", "product_id": product_id})],
+            [ToolCall("add_to_cart", {"user_id": "{user_id}", "product_id": product_id})],
+            [ToolCall("checkout", {"user_id": "{user_id}"})],
+        ],
+        reply,
+        stop_on=("is_duplicate_order", "True", "You already ordered this. Order it again?"),
+    )
+
+
+CONCIERGE_SCRIPTS = [
+    _profile(r"waist size is", "Size 32 saved.", size="32"),
+    _profile(r"my address is", "Address updated.", address="123 Main St, Springfield, 90210"),
+    _profile(r"payment method", "Payment set to Amex ending 1234.", payment="Amex ending 1234"),
+    _profile(r"no calls", "Noted: text only.", preferences={"contact": "text only"}),
+    _profile(r"traveling to", "Safe travels to Paris.", travel={"status": "traveling", "location": "Paris"}),
+    _profile(r"concierge style", "Tone set to friendly.", preferences={"concierge_tone": "friendly"}),
+    _order(r"green hoodie", "green hoodie", "p4", "Order placed: Green Hoodie, delivering to Paris."),
+    _order(r"blue jeans", "blue jeans", "p1", "Order placed: Classic Blue Jeans."),
+    _order(r"black dress", "black dress", "p3", "Order placed: Elegant Black Dress!"),
+]
+
+# Mirrors the orchestrator's routing instructions; anything else goes to the shopping agent.
+CONCIERGE_ROUTES = [
+    (r"address|payment|preference|concierge style|tone", "user-profile-agent"),
+    (r"coffee|latte|espresso|cappuccino", "coffee-agent"),
+]
+DEFAULT_MEMBER = "concierge-shopping-agent"
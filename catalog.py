@@ -0,0 +1,334 @@
+import csv
+import heapq
+import json
+import os
+import re
+import threading
+from array import array
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence
+
+INDEXED_FIELDS = ("brand", "color", "style")
+PRODUCT_FIELDS = ("id", "name", "brand", "color", "style", "price", "stock")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    # Lowercase word tokens with a naive plural strip, so "hoodies" finds "Green Hoodie".
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+# --- Columnar Storage ---
+class _StringColumn:
+    # All values live in one contiguous UTF-8 buffer addressed by an offsets array,
+    # so a million names cost one bytes object instead of a million str objects.
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array("Q", [0])
+
+    def append(self, value: str) -> None:
+        self._buffer += value.encode("utf-8")
+        self._offsets.append(len(self._buffer))
+
+    def freeze(self) -> "_StringColumn":
+        self._buffer = bytes(self._buffer)
+        return self
+
+    def __getitem__(self, pos: int) -> str:
+        return self._buffer[self._offsets[pos]:self._offsets[pos + 1]].decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+
+class _CategoryColumn:
+    # Dictionary-encoded column for low-cardinality attributes (brand, color, style).
+    def __init__(self):
+        self.categories: List[str] = []
+        self._codes_by_value: Dict[str, int] = {}
+        self.codes = array("I")
+
+    def append(self, value: str) -> None:
+        code = self._codes_by_value.get(value)
+        if code is None:
+            code = len(self.categories)
+            self._codes_by_value[value] = code
+            self.categories.append(value)
+        self.codes.append(code)
+
+    def __getitem__(self, pos: int) -> str:
+        return self.categories[self.codes[pos]]
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+
+class ProductTable:
+    """Column-oriented product storage; rows are only materialized as dicts on access."""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.names = _StringColumn()
+        self.brands = _CategoryColumn()
+        self.colors = _CategoryColumn()
+        self.styles = _CategoryColumn()
+        self.prices = array("d")
+        self.stock = array("q")
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "ProductTable":
+        table = cls()
+        for row in rows:
+            table.append(row)
+        table.names.freeze()
+        return table
+
+    def append(self, row: dict) -> None:
+        self.ids.append(str(row["id"]))
+        self.names.append(str(row.get("name") or ""))
+        self.brands.append(str(row.get("brand") or ""))
+        self.colors.append(str(row.get("color") or ""))
+        self.styles.append(str(row.get("style") or ""))
+        self.prices.append(float(row.get("price") or 0.0))
+        self.stock.append(int(row.get("stock") or 0))
+
+    def column(self, field: str):
+        return {"brand": self.brands, "color": self.colors, "style": self.styles}[field]
+
+    def row(self, pos: int) -> dict:
+        return {
+            "id": self.ids[pos],
+            "name": self.names[pos],
+            "brand": self.brands[pos],
+            "color": self.colors[pos],
+            "style": self.styles[pos],
+            "price": self.prices[pos],
+            "stock": self.stock[pos],
+        }
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+# --- Catalog Loaders ---
+def _read_jsonl(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def _read_csv(path: str) -> Iterator[dict]:
+    with open(path, encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f)
+
+
+def _load_parquet(path: str, batch_size: int = 65536) -> ProductTable:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Loading a Parquet catalog requires pyarrow: pip install pyarrow") from e
+    # memory_map lets the OS page the file in on demand instead of reading it up front;
+    # batches keep the transient Python objects bounded while the columns are filled.
+    parquet_file = pq.ParquetFile(path, memory_map=True)
+    table = ProductTable()
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=list(PRODUCT_FIELDS)):
+        for row in batch.to_pylist():
+            table.append(row)
+    table.names.freeze()
+    return table
+
+
+def load_product_table(path: str) -> ProductTable:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".jsonl", ".ndjson"):
+        return ProductTable.from_rows(_read_jsonl(path))
+    if ext == ".csv":
+        return ProductTable.from_rows(_read_csv(path))
+    if ext in (".parquet", ".pq"):
+        return _load_parquet(path)
+    raise ValueError(f"Unsupported catalog format: {path}")
+
+
+# --- Catalog ---
+class _CatalogIndex:
+    def __init__(self, table: ProductTable):
+        self.table = table
+        self.by_id: Dict[str, int] = {pid: pos for pos, pid in enumerate(table.ids)}
+        self.by_field: Dict[str, Dict[str, FrozenSet[int]]] = {}
+        for field in INDEXED_FIELDS:
+            column = table.column(field)
+            buckets: List[List[int]] = [[] for _ in column.categories]
+            for pos, code in enumerate(column.codes):
+                buckets[code].append(pos)
+            self.by_field[field] = {
+                value: frozenset(positions) for value, positions in zip(column.categories, buckets)
+            }
+        self.by_field_folded: Dict[str, Dict[str, FrozenSet[int]]] = {}
+        for field, values in self.by_field.items():
+            folded: Dict[str, FrozenSet[int]] = {}
+            for value, positions in values.items():
+                folded[value.casefold()] = folded.get(value.casefold(), frozenset()) | positions
+            self.by_field_folded[field] = folded
+        self._by_token: Optional[Dict[str, FrozenSet[int]]] = None
+        self._token_lock = threading.Lock()
+
+    @property
+    def by_token(self) -> Dict[str, FrozenSet[int]]:
+        # Built on the first text search only; filter-only workloads never pay for it.
+        if self._by_token is None:
+            with self._token_lock:
+                if self._by_token is None:
+                    postings: Dict[str, set] = {}
+                    table = self.table
+                    for pos in range(len(table)):
+                        text = " ".join((table.names[pos], table.brands[pos], table.colors[pos], table.styles[pos]))
+                        for token in set(tokenize(text)):
+                            postings.setdefault(token, set()).add(pos)
+                    self._by_token = {token: frozenset(positions) for token, positions in postings.items()}
+        return self._by_token
+
+
+class Catalog:
+    """Product catalog with an id hash index and secondary indexes on brand, color and style.
+
+    Backed by a columnar ProductTable. When constructed with a path the file is only
+    read on first access, so processes that never touch the catalog never pay for it.
+    """
+
+    def __init__(self, products: Optional[Iterable[dict]] = None, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        self._path = path
+        self._products = products
+        self._index: Optional[_CatalogIndex] = None
+        # Bumped on every refresh so derived indexes (e.g. the FTS table) know to resync.
+        self.version = 0
+
+    def _load(self) -> _CatalogIndex:
+        with self._lock:
+            if self._index is None:
+                if self._path:
+                    table = load_product_table(self._path)
+                else:
+                    table = ProductTable.from_rows(self._products or ())
+                self._products = None
+                self._index = _CatalogIndex(table)
+            return self._index
+
+    @property
+    def index(self) -> _CatalogIndex:
+        return self._index or self._load()
+
+    def refresh(self, products: Optional[Iterable[dict]] = None) -> None:
+        # Build the new index off to the side, then swap the reference in one step so
+        # readers always see either the old or the new catalog, never a mix.
+        if products is not None:
+            table = ProductTable.from_rows(products)
+        elif self._path:
+            table = load_product_table(self._path)
+        else:
+            table = self.index.table
+        index = _CatalogIndex(table)
+        with self._lock:
+            self._index = index
+            self.version += 1
+
+    def __len__(self) -> int:
+        return len(self.index.table)
+
+    def __contains__(self, product_id: str) -> bool:
+        return product_id in self.index.by_id
+
+    def __iter__(self) -> Iterator[dict]:
+        table = self.index.table
+        return (table.row(pos) for pos in range(len(table)))
+
+    def all(self) -> List[dict]:
+        return list(self)
+
+    def get(self, product_id: str) -> Optional[dict]:
+        index = self.index
+        pos = index.by_id.get(product_id)
+        return index.table.row(pos) if pos is not None else None
+
+    def stock(self, product_id: str) -> int:
+        index = self.index
+        pos = index.by_id.get(product_id)
+        return index.table.stock[pos] if pos is not None else 0
+
+    def set_stock(self, product_id: str, stock: int) -> None:
+        index = self.index
+        pos = index.by_id.get(product_id)
+        if pos is not None:
+            index.table.stock[pos] = max(0, stock)
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        brand: Optional[str] = None,
+        color: Optional[str] = None,
+        style: Optional[str] = None,
+        max_price: Optional[float] = None,
+        in_stock_only: bool = False,
+        limit: int = 10,
+        stock_of: Optional[Callable[[str], int]] = None,
+        relevance_by_id: Optional[Dict[str, float]] = None,
+        fields: Sequence[str] = PRODUCT_FIELDS,
+    ) -> List[dict]:
+        """Filter with the secondary indexes, rank by query-token matches, return the top `limit` rows.
+
+        `stock_of` overrides on-hand stock (e.g. to subtract cart reservations) for both the
+        in-stock filter and the returned rows. `relevance_by_id` replaces the token match
+        with externally computed scores (e.g. FTS5 BM25); products missing from it are
+        excluded. Only `fields` are included in each result.
+        """
+        index = self.index
+        table = index.table
+        candidates = None
+        for field, value in (("brand", brand), ("color", color), ("style", style)):
+            if value:
+                matched = index.by_field_folded[field].get(value.casefold(), frozenset())
+                candidates = matched if candidates is None else candidates & matched
+
+        relevance: Dict[int, float] = {}
+        tokens = tokenize(query) if query else []
+        if relevance_by_id is not None:
+            relevance = {index.by_id[pid]: score for pid, score in relevance_by_id.items() if pid in index.by_id}
+            matched = relevance.keys()
+            candidates = frozenset(matched) if candidates is None else candidates & matched
+        elif tokens:
+            by_token = index.by_token
+            for token in set(tokens):
+                for pos in by_token.get(token, ()):
+                    relevance[pos] = relevance.get(pos, 0) + 1
+            matched = relevance.keys()
+            candidates = frozenset(matched) if candidates is None else candidates & matched
+        if candidates is None:
+            candidates = range(len(table))
+
+        stock = (lambda pos: stock_of(table.ids[pos])) if stock_of else table.stock.__getitem__
+        ranked = (
+            ((relevance.get(pos, 0), stock(pos) > 0, -table.prices[pos], -pos), pos)
+            for pos in candidates
+            if (max_price is None or table.prices[pos] <= max_price)
+            and (not in_stock_only or stock(pos) > 0)
+        )
+        results = []
+        for _, pos in heapq.nlargest(limit, ranked):
+            row = table.row(pos)
+            row["stock"] = stock(pos)
+            results.append({field: row[field] for field in fields})
+        return results
+
+    def match_any(self, brands: Iterable[str] = (), colors: Iterable[str] = (), styles: Iterable[str] = (), limit: Optional[int] = None) -> List[dict]:
+        index = self.index
+        positions = set()
+        for field, values in (("brand", brands), ("color", colors), ("style", styles)):
+            for value in values:
+                positions |= index.by_field[field].get(value, frozenset())
+        return [index.table.row(pos) for pos in sorted(positions)[:limit]]
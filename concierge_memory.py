@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from agno.memory.v2.memory import Memory
+from agno.models.message import Message
+
+from history import HistoryCompactor
+from prompt_layout import strip_context
+
+logger = logging.getLogger(__name__)
+
+
+def _without_context(messages: List[Message]) -> List[Message]:
+    # Stored user turns carry the request context (ids and every memory) they were sent
+    # with; replaying it would repeat the memories once per turn, so only the current
+    # turn keeps its block.
+    return [
+        m.model_copy(update={"content": strip_context(m.content)})
+        if m.role == "user" and isinstance(m.content, str) and "<request_context>" in m.content
+        else m
+        for m in messages
+    ]
+
+
+class MemoryExtractionQueue:
+    """Runs queued user-memory extraction on a background thread, one batch per user.
+
+    A user's queued messages are extracted together once `batch_size` of them are waiting
+    or the oldest has waited `max_lag` seconds, whichever comes first, so memories are never
+    more than about `max_lag` plus one extraction call behind. Past `max_pending` queued
+    messages, submit() extracts inline instead of growing the queue.
+    """
+
+    def __init__(
+        self,
+        extract: Callable[[str, List[Message]], object],
+        max_lag: float = 5.0,
+        batch_size: int = 8,
+        max_pending: int = 10000,
+    ):
+        self.extract = extract
+        self.max_lag = max_lag
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        # user_id -> (monotonic time the oldest message was queued, messages)
+        self._pending: "OrderedDict[str, Tuple[float, List[Message]]]" = OrderedDict()
+        self._pending_count = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.extracted = 0
+        self.failures = 0
+        self.max_observed_lag = 0.0
+
+    def submit(self, user_id: str, messages: List[Message]) -> None:
+        with self._cond:
+            overflow = self._pending_count >= self.max_pending
+            if not overflow:
+                queued_at, queued = self._pending.get(user_id, (time.monotonic(), []))
+                queued.extend(messages)
+                self._pending[user_id] = (queued_at, queued)
+                self._pending_count += len(messages)
+                # Wakes the worker to either extract a full batch or re-arm its lag timer.
+                self._cond.notify()
+        if overflow:
+            self._process(user_id, time.monotonic(), list(messages))
+            return
+        self._start()
+
+    def _start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="memory-extraction", daemon=True)
+            self._thread.start()
+
+    def _take_due(self, force: bool) -> List[Tuple[str, float, List[Message]]]:
+        now = time.monotonic()
+        due = [
+            user_id
+            for user_id, (queued_at, messages) in self._pending.items()
+            if force or len(messages) >= self.batch_size or now - queued_at >= self.max_lag
+        ]
+        batches = []
+        for user_id in due:
+            queued_at, messages = self._pending.pop(user_id)
+            self._pending_count -= len(messages)
+            batches.append((user_id, queued_at, messages))
+        return batches
+
+    def _seconds_until_due(self) -> Optional[float]:
+        if not self._pending:
+            return None
+        oldest = next(iter(self._pending.values()))[0]
+        return max(0.0, oldest + self.max_lag - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                batches = self._take_due(force=self._stopping)
+                while not batches and not self._stopping:
+                    self._cond.wait(self._seconds_until_due())
+                    batches = self._take_due(force=self._stopping)
+                if not batches and self._stopping:
+                    return
+            for user_id, queued_at, messages in batches:
+                self._process(user_id, queued_at, messages)
+
+    def _process(self, user_id: str, queued_at: float, messages: List[Message]) -> None:
+        self.max_observed_lag = max(self.max_observed_lag, time.monotonic() - queued_at)
+        try:
+            self.extract(user_id, messages)
+        except Exception:
+            self.failures += 1
+            logger.exception("User memory extraction failed for %s (%d messages dropped)", user_id, len(messages))
+            return
+        self.batches += 1
+        self.extracted += len(messages)
+
+    def flush(self) -> None:
+        """Extract everything queued right now, on the calling thread."""
+        with self._cond:
+            batches = self._take_due(force=True)
+        for user_id, queued_at, messages in batches:
+            self._process(user_id, queued_at, messages)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._pending_count,
+            "batches": self.batches,
+            "extracted": self.extracted,
+            "failures": self.failures,
+            "max_observed_lag_s": self.max_observed_lag,
+        }
+
+
+class ConciergeMemory(Memory):
+    """agno Memory with deferred user-memory extraction and token-budgeted history.
+
+    With defer_extraction, create_user_memories() (called by agents after every run when
+    enable_user_memories=True) only enqueues the messages, and MemoryExtractionQueue writes
+    the extracted memories to the same db in per-user batches.
+
+    With a history compactor, get_messages_from_last_n_runs() (what agents replay when
+    add_history_to_messages=True) returns history fitted to the compactor's token budget
+    instead of the last N runs verbatim.
+    """
+
+    def __init__(
+        self,
+        *args,
+        defer_extraction: bool = True,
+        max_lag_seconds: float = 5.0,
+        batch_size: int = 8,
+        history: Optional[HistoryCompactor] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.defer_extraction = defer_extraction
+        self.history = history
+        self.extraction_queue = MemoryExtractionQueue(
+            self._extract_now, max_lag=max_lag_seconds, batch_size=batch_size
+        )
+
+    def __deepcopy__(self, memo):
+        # agno deep-copies a team member's memory on its first run. The queue (a worker
+        # thread and its lock) and the history compactor are process-wide, so the copy
+        # shares them, as agno already does for db and memory_manager.
+        memo[id(self.extraction_queue)] = self.extraction_queue
+        if self.history is not None:
+            memo[id(self.history)] = self.history
+        return super().__deepcopy__(memo)
+
+    def get_messages_from_last_n_runs(self, session_id: str, *args, last_n: Optional[int] = None, **kwargs) -> List[Message]:
+        if self.history is None:
+            return _without_context(super().get_messages_from_last_n_runs(session_id, *args, last_n=last_n, **kwargs))
+        # The budget, not the run count, decides how much is replayed verbatim.
+        messages = _without_context(super().get_messages_from_last_n_runs(session_id, *args, last_n=None, **kwargs))
+        return self.history.compact(
+            messages,
+            session_id=session_id,
+            agent_id=kwargs.get("agent_id") or kwargs.get("team_id"),
+            summary_message=lambda text: Message(role="system", content=text),
+        )
+
+    def _extract_now(self, user_id: str, messages: List[Message]) -> str:
+        return super().create_user_memories(messages=messages, user_id=user_id)
+
+    def create_user_memories(
+        self,
+        message: Optional[str] = None,
+        messages: Optional[List[Message]] = None,
+        user_id: Optional[str] = None,
+        refresh_from_db: bool = True,
+    ) -> str:
+        if message:
+            # The appended request context repeats stored memories; extract from the user's words only.
+            message = strip_context(message)
+        if not self.defer_extraction:
+            return super().create_user_memories(message, messages, user_id, refresh_from_db)
+        if message:
+            messages = [Message(role="user", content=message)]
+        if not messages or not isinstance(messages, list):
+            raise ValueError("You must provide either a message or a list of messages")
+        self.extraction_queue.submit(user_id or "default", messages)
+        return "User memory update queued"
+
+    async def acreate_user_memories(
+        self,
+        message: Optional[str] = None,
+        messages: Optional[List[Message]] = None,
+        user_id: Optional[str] = None,
+        refresh_from_db: bool = True,
+    ) -> str:
+        if not self.defer_extraction:
+            return await super().acreate_user_memories(message, messages, user_id, refresh_from_db)
+        return self.create_user_memories(message=message, messages=messages, user_id=user_id)
@@ -0,0 +1,206 @@
+import argparse
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import MetaData, create_engine, event, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_DATABASE_URL = "sqlite:///shopping.db"
+# Execution option that overrides the engine's BEGIN mode for one connection or session.
+BEGIN_MODE_OPTION = "sqlite_begin_mode"
+
+# Profile tables hold one current row per key; older databases appended a row per update.
+# Each entry is backed by a unique index named ux_<table>_<columns> on the models.
+CURRENT_VALUE_TABLES: Dict[str, Tuple[str, ...]] = {
+    "addresses": ("user_id",),
+    "sizes": ("user_id",),
+    "payments": ("user_id",),
+    "travels": ("user_id",),
+    "preferences": ("user_id", "key"),
+}
+# Non-unique indexes made redundant by the unique ones above.
+SUPERSEDED_INDEXES = (
+    "ix_addresses_user_id",
+    "ix_sizes_user_id",
+    "ix_payments_user_id",
+    "ix_travels_user_id",
+    "ix_preferences_user_id_key",
+)
+
+
+def _env(name: str, default):
+    value = os.getenv(name)
+    return type(default)(value) if value is not None else default
+
+
+def create_sqlite_engine(
+    url: Optional[str] = None,
+    *,
+    journal_mode: Optional[str] = None,
+    synchronous: Optional[str] = None,
+    busy_timeout_ms: Optional[int] = None,
+    mmap_size: Optional[int] = None,
+    cache_size_kib: Optional[int] = None,
+    begin_mode: Optional[str] = None,
+    pool_size: Optional[int] = None,
+    max_overflow: Optional[int] = None,
+    pool_timeout: Optional[float] = None,
+    echo: bool = False,
+) -> Engine:
+    """Create the shared SQLite engine with WAL journaling, a busy timeout and tuned pragmas.
+
+    Every option falls back to a SHOPPING_DB_* / SQLITE_* environment variable and then
+    to a default suited to many concurrent concierge sessions.
+    """
+    url = url or _env("SHOPPING_DB_URL", DEFAULT_DATABASE_URL)
+    journal_mode = journal_mode or _env("SQLITE_JOURNAL_MODE", "WAL")
+    synchronous = synchronous or _env("SQLITE_SYNCHRONOUS", "NORMAL")
+    busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else _env("SQLITE_BUSY_TIMEOUT_MS", 5000)
+    mmap_size = mmap_size if mmap_size is not None else _env("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+    cache_size_kib = cache_size_kib if cache_size_kib is not None else _env("SQLITE_CACHE_SIZE_KIB", 64 * 1024)
+    # DEFERRED lets read transactions run alongside a writer under WAL. Transactions that
+    # write opt into IMMEDIATE with writer(engine), so read-then-write tools such as
+    # add_to_cart wait on busy_timeout up front instead of failing on lock upgrade.
+    begin_mode = (begin_mode or _env("SQLITE_BEGIN_MODE", "DEFERRED")).upper()
+    pool_size = pool_size if pool_size is not None else _env("SHOPPING_DB_POOL_SIZE", 10)
+    max_overflow = max_overflow if max_overflow is not None else _env("SHOPPING_DB_MAX_OVERFLOW", 20)
+    pool_timeout = pool_timeout if pool_timeout is not None else _env("SHOPPING_DB_POOL_TIMEOUT", 30.0)
+
+    engine = create_engine(
+        url,
+        echo=echo,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        connect_args={"check_same_thread": False, "timeout": busy_timeout_ms / 1000},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        # Let SQLAlchemy's "begin" hook below issue BEGIN instead of the sqlite3 driver.
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        cursor.execute(f"PRAGMA cache_size=-{int(cache_size_kib)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _begin(conn):
+        conn.exec_driver_sql(f"BEGIN {conn.get_execution_options().get(BEGIN_MODE_OPTION, begin_mode)}")
+
+    return engine
+
+
+def writer(engine: Engine) -> Engine:
+    """The same engine (and pool), but every transaction starts with BEGIN IMMEDIATE."""
+    return engine.execution_options(**{BEGIN_MODE_OPTION: "IMMEDIATE"})
+
+
+def ensure_indexes(engine: Engine, metadata: MetaData) -> List[str]:
+    """Create any index declared on the models but missing from an existing database.
+
+    create_all() skips tables that already exist, including their indexes, so older
+    shopping.db files need this to pick up new indexes. Safe to run on every start.
+    """
+    created = []
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                try:
+                    index.create(engine)
+                except IntegrityError as e:
+                    raise RuntimeError(
+                        f"Cannot create unique index {index.name}: {table.name} still has duplicate rows "
+                        f"from before upserts. Run `python db.py compact` against this database first."
+                    ) from e
+                created.append(index.name)
+    return created
+
+
+def upsert(session, model, keys: Dict[str, object], values: Dict[str, object]) -> None:
+    """Insert a row, or update `values` on the row that already has these `keys`."""
+    session.execute(
+        sqlite_insert(model)
+        .values(**keys, **values)
+        .on_conflict_do_update(index_elements=list(keys), set_=values)
+    )
+
+
+def compact_table(engine: Engine, table: str, key_columns: Sequence[str], batch_size: int = 10000) -> int:
+    """Delete every row except the newest (highest id) per key, one id range per transaction.
+
+    The ids to keep are computed once into a temp table, so each batch is a bounded range
+    delete and writers are only blocked for one batch at a time.
+    """
+    keys = ", ".join(key_columns)
+    deleted = 0
+    with engine.connect() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.compact_keep")
+        conn.exec_driver_sql(
+            f"CREATE TEMP TABLE compact_keep AS SELECT MAX(id) AS id FROM {table} GROUP BY {keys}"
+        )
+        conn.exec_driver_sql("CREATE UNIQUE INDEX temp.ix_compact_keep_id ON compact_keep (id)")
+        low, high = conn.exec_driver_sql(f"SELECT MIN(id), MAX(id) FROM {table}").one()
+        conn.commit()
+        if low is None:
+            return 0
+        for start in range(low, high + 1, batch_size):
+            result = conn.exec_driver_sql(
+                f"DELETE FROM {table} WHERE id >= ? AND id < ? AND id NOT IN (SELECT id FROM compact_keep)",
+                (start, start + batch_size),
+            )
+            conn.commit()
+            deleted += result.rowcount
+        conn.exec_driver_sql("DROP TABLE temp.compact_keep")
+        conn.commit()
+    return deleted
+
+
+def compact_profile_tables(engine: Engine, batch_size: int = 10000) -> Dict[str, int]:
+    existing = set(inspect(engine).get_table_names())
+    deleted = {}
+    for table, key_columns in CURRENT_VALUE_TABLES.items():
+        if table not in existing:
+            continue
+        deleted[table] = compact_table(engine, table, key_columns, batch_size)
+        with engine.begin() as conn:
+            conn.exec_driver_sql(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS ux_{table}_{'_'.join(key_columns)} "
+                f"ON {table} ({', '.join(key_columns)})"
+            )
+    with engine.begin() as conn:
+        for name in SUPERSEDED_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {name}")
+    return deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="shopping.db maintenance")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    compact = subcommands.add_parser("compact", help="collapse append-only profile tables to their latest row")
+    compact.add_argument("--url", default=None, help="database URL (default: SHOPPING_DB_URL or sqlite:///shopping.db)")
+    compact.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        engine = create_sqlite_engine(args.url)
+        for table, count in compact_profile_tables(engine, args.batch_size).items():
+            print(f"{table}: removed {count} historical rows")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
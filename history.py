@@ -0,0 +1,158 @@
+import ast
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import TTLCache
+
+# Rough OpenAI-style estimate; good enough to keep the prompt under a budget without a tokenizer.
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def _message_text(message) -> str:
+    text = message.get_content_string() if message.content is not None else ""
+    if message.tool_calls:
+        text += json.dumps(message.tool_calls, default=str)
+    return text
+
+
+def _shrink(value: Any, max_items: int, max_chars: int) -> Any:
+    # Keep the shape the model needs (keys, first few rows, counts) and drop the bulk.
+    if isinstance(value, dict):
+        return {k: _shrink(v, max_items, max_chars) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        kept = [_shrink(v, max_items, max_chars) for v in value[:max_items]]
+        if len(value) > max_items:
+            kept.append(f"... {len(value) - max_items} more")
+        return kept
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "..."
+    return value
+
+
+def compact_tool_result(content: str, max_chars: int = 600, max_items: int = 3) -> str:
+    """Shrink a replayed tool result: long lists keep their first rows plus a count, then cap the size."""
+    if len(content) <= max_chars:
+        return content
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(content)
+        except (ValueError, SyntaxError, MemoryError, RecursionError):
+            parsed = None
+    if parsed is not None:
+        content = str(_shrink(parsed, max_items, max_chars // 4))
+    if len(content) > max_chars:
+        content = content[:max_chars] + " ...[truncated]"
+    return content
+
+
+def _split_turns(messages: List) -> List[List]:
+    turns: List[List] = []
+    for message in messages:
+        if message.role == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _summarize_turn(turn: List, max_chars: int) -> str:
+    user = next((m.get_content_string() for m in turn if m.role == "user"), "")
+    tools = [m.tool_name for m in turn if m.role == "tool" and m.tool_name]
+    reply = next((m.get_content_string() for m in reversed(turn) if m.role == "assistant" and m.content), "")
+    line = f"- User: {user[:max_chars]}"
+    if tools:
+        line += f" | tools: {', '.join(dict.fromkeys(tools))}"
+    if reply:
+        line += f" | Assistant: {reply[:max_chars]}"
+    return line
+
+
+class HistoryCompactor:
+    """Fits replayed conversation history into a token budget.
+
+    Tool results are shrunk to their essential fields, the newest turns are kept verbatim
+    while they fit, and everything older is collapsed into a rolling per-session summary
+    that is extended (never rebuilt) as more turns age out.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 2000,
+        tool_result_max_chars: int = 600,
+        summary_max_lines: int = 20,
+        summary_line_chars: int = 160,
+        max_sessions: int = 10000,
+    ):
+        self.token_budget = token_budget
+        self.tool_result_max_chars = tool_result_max_chars
+        self.summary_max_lines = summary_max_lines
+        self.summary_line_chars = summary_line_chars
+        # (session_id, agent_id) -> (turns summarized so far, summary lines)
+        self.summaries = TTLCache(maxsize=max_sessions, ttl=None)
+        self.last_stats: Dict[str, int] = {}
+
+    def _compact_message(self, message):
+        if message.role == "tool" and message.content is not None:
+            content = compact_tool_result(message.get_content_string(), self.tool_result_max_chars)
+            if content != message.content:
+                return message.model_copy(update={"content": content})
+        return message
+
+    def _rolling_summary(self, key: Tuple[str, Optional[str]], turns: List[List], count: int) -> List[str]:
+        done, lines = self.summaries.get(key, (0, []))
+        if done > count:
+            # The session shrank (e.g. runs were deleted); start over.
+            done, lines = 0, []
+        lines = lines + [_summarize_turn(turn, self.summary_line_chars) for turn in turns[done:count]]
+        return lines[-self.summary_max_lines:]
+
+    @staticmethod
+    def _summary_text(lines: List[str]) -> str:
+        return "Summary of earlier turns in this conversation:\n" + "\n".join(lines)
+
+    def compact(self, messages: List, session_id: str, agent_id: Optional[str] = None, summary_message=None) -> List:
+        """Return history that fits the budget. `summary_message(text)` builds the summary Message."""
+        raw_tokens = sum(estimate_tokens(_message_text(m)) for m in messages)
+        system = [m for m in messages if m.role == "system"]
+        turns = _split_turns([m for m in messages if m.role != "system"])
+
+        budget = self.token_budget - sum(estimate_tokens(_message_text(m)) for m in system)
+        kept_from = len(turns)
+        used = 0
+        for i in range(len(turns) - 1, -1, -1):
+            # Only turns that might be replayed are compacted; older ones are just summarized.
+            turns[i] = [self._compact_message(m) for m in turns[i]]
+            cost = sum(estimate_tokens(_message_text(m)) for m in turns[i])
+            # The latest turn is always kept so the model sees what it just did.
+            if used + cost > budget and i < len(turns) - 1:
+                break
+            used += cost
+            kept_from = i
+
+        result = list(system)
+        if kept_from > 0 and summary_message is not None:
+            key = (session_id, agent_id)
+            summary = summary_message(self._summary_text(self._rolling_summary(key, turns, kept_from)))
+            # The summary shares the budget: age out more verbatim turns until both fit.
+            while kept_from < len(turns) - 1 and used + estimate_tokens(_message_text(summary)) > budget:
+                used -= sum(estimate_tokens(_message_text(m)) for m in turns[kept_from])
+                kept_from += 1
+                summary = summary_message(self._summary_text(self._rolling_summary(key, turns, kept_from)))
+            self.summaries.set(key, (kept_from, self._rolling_summary(key, turns, kept_from)))
+            result.append(summary)
+        for turn in turns[kept_from:]:
+            result.extend(turn)
+
+        self.last_stats = {
+            "raw_tokens": raw_tokens,
+            "compacted_tokens": sum(estimate_tokens(_message_text(m)) for m in result),
+            "turns_kept": len(turns) - kept_from,
+            "turns_summarized": kept_from,
+        }
+        return result
@@ -0,0 +1,68 @@
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationCounter:
+    """Process-local totals of units held in carts, so check_stock never has to query the DB.
+
+    Holds placed or released by this process are applied immediately; holds from other
+    workers are picked up whenever the sweeper replaces the totals from the database.
+    """
+
+    def __init__(self):
+        self._reserved: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, product_id: str, quantity: int) -> None:
+        with self._lock:
+            self._reserved[product_id] = self._reserved.get(product_id, 0) + quantity
+
+    def release(self, product_id: str, quantity: int) -> None:
+        with self._lock:
+            remaining = self._reserved.get(product_id, 0) - quantity
+            if remaining > 0:
+                self._reserved[product_id] = remaining
+            else:
+                self._reserved.pop(product_id, None)
+
+    def replace(self, totals: Dict[str, int]) -> None:
+        reserved = {product_id: int(qty) for product_id, qty in totals.items() if qty}
+        with self._lock:
+            self._reserved = reserved
+
+    def reserved(self, product_id: str) -> int:
+        return self._reserved.get(product_id, 0)
+
+
+class ReservationSweeper:
+    """Daemon thread that calls `sweep` every `interval` seconds until stopped."""
+
+    def __init__(self, sweep: Callable[[], int], interval: float = 30.0):
+        self.sweep = sweep
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reservation-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                released = self.sweep()
+                if released:
+                    logger.info("Released %d expired stock reservations", released)
+            except Exception:
+                logger.exception("Reservation sweep failed")
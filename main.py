@@ -1,29 +1,24 @@
 from agno.agent import Agent
 from agno.models.openai import OpenAIChat
-from typing import List, Dict
+from typing import List, Optional, Union
 from agno.memory.v2.db.sqlite import SqliteMemoryDb
 from agno.memory.v2.memory import Memory
-import uuid
+import os
 from dotenv import load_dotenv
 load_dotenv()
 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Table, Text, DateTime, Float
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship, joinedload
+from sqlalchemy import exists, tuple_, Column, Index, Integer, String, ForeignKey, Table, Text, DateTime, Float
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 import datetime
-
-# --- Dummy Data ---
-PRODUCTS = [
-    {"id": "p1", "name": "Classic Blue Jeans", "brand": "Levi's", "color": "blue", "style": "casual", "price": 89.99, "stock": 10},
-    {"id": "p2", "name": "Red Running Shoes", "brand": "Nike", "color": "red", "style": "sporty", "price": 129.99, "stock": 0},  # Out of stock for edge case
-    {"id": "p3", "name": "Elegant Black Dress", "brand": "Zara", "color": "black", "style": "formal", "price": 79.99, "stock": 3},
-    {"id": "p4", "name": "Green Hoodie", "brand": "Uniqlo", "color": "green", "style": "casual", "price": 49.99, "stock": 8},
-    {"id": "p5", "name": "White Sneakers", "brand": "Adidas", "color": "white", "style": "sporty", "price": 89.99, "stock": 6},
-]
+import base
+from db import create_sqlite_engine, ensure_indexes, upsert, writer
 
 # --- SQLAlchemy Setup ---
 Base = declarative_base()
-engine = create_engine('sqlite:///shopping.db')
+engine = create_sqlite_engine()
 SessionLocal = sessionmaker(bind=engine)
+# Sessions that write begin IMMEDIATE; reads stay DEFERRED so they never take the write lock.
+WriteSessionLocal = sessionmaker(bind=writer(engine))
 
 # --- Models ---
 class User(Base):
@@ -42,6 +37,7 @@ class User(Base):
 
 class Address(Base):
     __tablename__ = 'addresses'
+    __table_args__ = (Index('ux_addresses_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     address = Column(Text)
@@ -49,6 +45,7 @@ class Address(Base):
 
 class Size(Base):
     __tablename__ = 'sizes'
+    __table_args__ = (Index('ux_sizes_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     size = Column(String)
@@ -56,6 +53,7 @@ class Size(Base):
 
 class Payment(Base):
     __tablename__ = 'payments'
+    __table_args__ = (Index('ux_payments_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     method = Column(String)
@@ -63,6 +61,7 @@ class Payment(Base):
 
 class Preference(Base):
     __tablename__ = 'preferences'
+    __table_args__ = (Index('ux_preferences_user_id_key', 'user_id', 'key', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     key = Column(String)
@@ -71,6 +70,7 @@ class Preference(Base):
 
 class Travel(Base):
     __tablename__ = 'travels'
+    __table_args__ = (Index('ux_travels_user_id', 'user_id', unique=True),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     status = Column(String)
@@ -80,12 +80,13 @@ class Travel(Base):
 class Birthday(Base):
     __tablename__ = 'birthdays'
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     birthday = Column(String)  # YYYY-MM-DD
     user = relationship('User', back_populates='birthdays')
 
 class Cart(Base):
     __tablename__ = 'carts'
+    __table_args__ = (Index('ix_carts_user_id_product_id', 'user_id', 'product_id'),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     product_id = Column(String)
@@ -94,6 +95,7 @@ class Cart(Base):
 
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (Index('ix_orders_user_id_created_at_id', 'user_id', 'created_at', 'id'),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
     address = Column(Text)
@@ -104,27 +106,31 @@ class Order(Base):
 
 class OrderItem(Base):
     __tablename__ = 'order_items'
+    __table_args__ = (Index('ix_order_items_product_id_order_id', 'product_id', 'order_id'),)
     id = Column(Integer, primary_key=True)
-    order_id = Column(Integer, ForeignKey('orders.id'))
+    order_id = Column(Integer, ForeignKey('orders.id'), index=True)
     product_id = Column(String)
     quantity = Column(Integer)
     order = relationship('Order', back_populates='items')
 
-# Create tables
+# Create tables, then add any indexes missing from databases created before they existed
 Base.metadata.create_all(engine)
+ensure_indexes(engine, Base.metadata)
+base.init_db()
 
 # --- Tool Functions ---
-def get_product_list() -> List[dict]:
-    return PRODUCTS
+def get_product_list() -> Union[List[dict], dict]:
+    # base owns the catalog and the stock checkout decrements; CATALOG_PATH is read there.
+    return base.get_product_list.entrypoint()
 
 def check_stock(product_id: str) -> dict:
-    for p in PRODUCTS:
-        if p["id"] == product_id:
-            return {"product_id": product_id, "stock": p["stock"]}
-    return {"product_id": product_id, "stock": 0}
+    # Stock lives in the Inventory table that checkout decrements, net of cart holds.
+    return base.check_stock.entrypoint(product_id)
 
 def add_to_cart(user_id: str, product_id: str, quantity: int = 1) -> str:
-    session = SessionLocal()
+    if quantity < 1:
+        return f"Quantity must be at least 1, got {quantity}."
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
@@ -141,13 +147,13 @@ def add_to_cart(user_id: str, product_id: str, quantity: int = 1) -> str:
     return f"Added {quantity} of {product_id} to {user_id}'s cart."
 
 def set_address(user_id: str, address: str) -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.addresses.append(Address(address=address))
+    upsert(session, Address, {"user_id": user.id}, {"address": address})
     session.commit()
     session.close()
     return f"Address for {user_id} set to: {address}"
@@ -161,13 +167,13 @@ def get_address(user_id: str) -> str:
     return "No address set."
 
 def set_size(user_id: str, size: str) -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.sizes.append(Size(size=size))
+    upsert(session, Size, {"user_id": user.id}, {"size": size})
     session.commit()
     session.close()
     return f"Size for {user_id} set to: {size}"
@@ -181,13 +187,13 @@ def get_size(user_id: str) -> str:
     return "No size set."
 
 def set_calendar_location(user_id: str, location: str) -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.travels.append(Travel(status="home", location=location)) # Assuming default to home
+    upsert(session, Travel, {"user_id": user.id}, {"status": "home", "location": location}) # Assuming default to home
     session.commit()
     session.close()
     return f"Calendar location for {user_id} set to: {location}"
@@ -201,13 +207,13 @@ def get_calendar_location(user_id: str) -> str:
     return "office"
 
 def set_payment_method(user_id: str, method: str) -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.payments.append(Payment(method=method))
+    upsert(session, Payment, {"user_id": user.id}, {"method": method})
     session.commit()
     session.close()
     return f"Payment method set to {method}"
@@ -221,13 +227,13 @@ def get_payment_method(user_id: str) -> str:
     return "No payment method set."
 
 def set_preference(user_id: str, key: str, value: str) -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.preferences.append(Preference(key=key, value=value))
+    upsert(session, Preference, {"user_id": user.id, "key": key}, {"value": value})
     session.commit()
     session.close()
     return f"Preference {key} set to {value}"
@@ -242,13 +248,13 @@ def get_preference(user_id: str, key: str) -> str:
     return "Not set"
 
 def set_travel_status(user_id: str, status: str, location: str = "") -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.travels.append(Travel(status=status, location=location))
+    upsert(session, Travel, {"user_id": user.id}, {"status": status, "location": location})
     session.commit()
     session.close()
     return f"Travel status set to {status} at {location}"
@@ -262,32 +268,14 @@ def get_travel_status(user_id: str) -> dict:
     return {"status": "home", "location": get_address(user_id)}
 
 def checkout(user_id: str) -> str:
-    session = SessionLocal()
-    user = session.query(User).options(joinedload(User.addresses), joinedload(User.carts)).filter_by(email=user_id).first()
-    if not user:
-        session.close()
-        return "User not found. Please register."
-
-    if not user.addresses:
-        session.close()
-        return "No address set. Please provide a shipping address before checkout."
-
-    order_id = str(uuid.uuid4())
-    order = Order(user_id=user.id, address=user.addresses[0].address, status="Processing")
-    session.add(order)
-    session.commit()  # Commit to get order.id
-
-    for item in user.carts:
-        product = next((p for p in PRODUCTS if p["id"] == item.product_id), None)
-        if product:
-            order_item = OrderItem(order_id=order.id, product_id=item.product_id, quantity=item.quantity)
-            session.add(order_item)
-            product["stock"] = max(0, product["stock"] - item.quantity)
-        session.delete(item)  # Remove from cart after checkout
-
-    session.commit()
-    session.close()
-    return f"Order placed! Your order ID is {order_id}."
+    # base.checkout decrements Inventory in one conditional transaction, so orders placed
+    # here can never oversell against holds or sales from the concierge app.
+    result = base.checkout.entrypoint(user_id)
+    if result["status"] == "placed":
+        return f"Order placed! Your order ID is {result['order_id']}."
+    if result["status"] == "out_of_stock":
+        return f"Sorry, not enough stock for: {', '.join(result['unavailable'])}."
+    return result["message"]
 
 def check_order_status(order_id: str) -> str:
     session = SessionLocal()
@@ -301,15 +289,7 @@ def check_delivery_date(product_id: str, zip_code: str) -> str:
     return f"Estimated delivery for {product_id} to {zip_code}: 3-5 business days."
 
 def recommend_products(user_profile: dict) -> List[dict]:
-    matches = []
-    for p in PRODUCTS:
-        if (p["brand"] in user_profile.get("brands", [])) or \
-           (p["color"] in user_profile.get("colors", [])) or \
-           (p["style"] in user_profile.get("styles", [])):
-            matches.append(p)
-        if len(matches) >= 3:
-            break
-    return matches
+    return base.recommend_products.entrypoint(user_profile)
 
 def get_birthday(user_id: str) -> str:
     session = SessionLocal()
@@ -319,36 +299,57 @@ def get_birthday(user_id: str) -> str:
         return user.birthdays[0].birthday if user.birthdays else ""
     return ""
 
-def get_order_history(user_id: str) -> List[Dict]:
+def get_order_history(user_id: str, cursor: Optional[str] = None, page_size: int = 10) -> dict:
+    # Keyset pagination on (created_at, id), newest first, projecting only the columns the model needs.
+    page_size = max(1, min(page_size, 50))
+    position = base.parse_order_cursor(cursor) if cursor else None
+    if cursor and position is None:
+        return dict(base.ORDER_CURSOR_ERROR)
     session = SessionLocal()
-    user = session.query(User).filter_by(email=user_id).first()
-    session.close()
-    if not user:
-        return []
-    return [o.__dict__ for o in user.orders]
+    try:
+        query = session.query(Order.id, Order.status, Order.address, Order.created_at) \
+            .join(User, Order.user_id == User.id).filter(User.email == user_id)
+        if position:
+            query = query.filter(tuple_(Order.created_at, Order.id) < tuple_(*position))
+        rows = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(page_size + 1).all()
+    finally:
+        session.close()
+    orders = [
+        {
+            "id": row.id,
+            "status": row.status,
+            "address": row.address,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in rows[:page_size]
+    ]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        next_cursor = f"{last.created_at.isoformat()}|{last.id}"
+    return {"orders": orders, "next_cursor": next_cursor}
 
 def is_duplicate_order(user_id: str, product_id: str) -> bool:
+    # One indexed EXISTS probe instead of loading every order and item of the user.
     session = SessionLocal()
-    user = session.query(User).options(joinedload(User.orders).joinedload(Order.items)).filter_by(email=user_id).first()
-    if not user:
-        session.close()
-        return False
-    for order in user.orders:
-        for item in order.items:
-            if item.product_id == product_id:
-                session.close()
-                return True
+    found = session.query(
+        exists()
+        .where(OrderItem.order_id == Order.id)
+        .where(Order.user_id == User.id)
+        .where(User.email == user_id)
+        .where(OrderItem.product_id == product_id)
+    ).scalar()
     session.close()
-    return False
+    return found
 
 def set_concierge_tone(user_id: str, tone: str) -> str:
-    session = SessionLocal()
+    session = WriteSessionLocal()
     user = session.query(User).filter_by(email=user_id).first()
     if not user:
         user = User(email=user_id)
         session.add(user)
         session.commit()
-    user.preferences.append(Preference(key="concierge_tone", value=tone))
+    upsert(session, Preference, {"user_id": user.id, "key": "concierge_tone"}, {"value": tone})
     session.commit()
     session.close()
     return f"Concierge tone set to {tone}"
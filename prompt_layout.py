@@ -0,0 +1,61 @@
+import os
+import re
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from history import CHARS_PER_TOKEN
+
+# An instruction is volatile if it carries a per-request state placeholder like {current_user_id}.
+_PLACEHOLDER = re.compile(r"\{[a-z_][a-z0-9_]*\}")
+_CONTEXT_BLOCK = re.compile(r"\n\n<request_context>\n.*\n</request_context>$", re.DOTALL)
+
+
+def split_instructions(instructions: Sequence[str]) -> Tuple[List[str], List[str]]:
+    """Split instructions into (static, volatile) while keeping each list's order."""
+    static = [line for line in instructions if not _PLACEHOLDER.search(line)]
+    volatile = [line for line in instructions if _PLACEHOLDER.search(line)]
+    return static, volatile
+
+
+def render_context(volatile: Sequence[str], values: Dict[str, str]) -> str:
+    return "\n".join(line.format_map(values) for line in volatile)
+
+
+def render_memories(memories: Sequence[str]) -> str:
+    """User memories as a request-context block, in place of agno's system-prompt section."""
+    if not memories:
+        return ""
+    lines = "\n".join(f"- {memory}" for memory in memories)
+    return (
+        f"<memories_from_previous_interactions>\n{lines}\n</memories_from_previous_interactions>\n"
+        "Prefer anything said in this conversation over these memories."
+    )
+
+
+def with_context(message: str, context: str) -> str:
+    """Append per-request context to the end of the user message, after everything cacheable."""
+    if not context:
+        return message
+    return f"{message}\n\n<request_context>\n{context}\n</request_context>"
+
+
+def strip_context(message: str) -> str:
+    """Undo with_context(), e.g. so the request context is not mined for new memories."""
+    return _CONTEXT_BLOCK.sub("", message)
+
+
+def prefix_report(render: Callable[[str, str], str], sessions: Sequence[Tuple[str, str]]) -> dict:
+    """Measure how much of the rendered prompt is byte-identical across (user_id, session_id) pairs.
+
+    `render` returns the full prompt as the provider sees it (tool schemas, system message,
+    then the user turn); the shared prefix is what provider-side prompt caching can reuse.
+    """
+    prompts = [render(user_id, session_id) for user_id, session_id in sessions]
+    prefix = len(os.path.commonprefix(prompts))
+    average = sum(len(p) for p in prompts) / len(prompts)
+    return {
+        "prompts": len(prompts),
+        "cacheable_prefix_chars": prefix,
+        "cacheable_prefix_tokens": prefix // CHARS_PER_TOKEN,
+        "avg_prompt_tokens": int(average // CHARS_PER_TOKEN),
+        "cacheable_ratio": prefix / average if average else 0.0,
+    }
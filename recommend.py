@@ -0,0 +1,149 @@
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from catalog import INDEXED_FIELDS, Catalog
+
+# Score contributions per matching attribute. Stated likes outweigh attributes inferred
+# from past orders, which in turn outweigh the price-fit term.
+PROFILE_WEIGHTS = {"brand": 3.0, "color": 2.0, "style": 2.0}
+HISTORY_WEIGHT = 0.5
+PRICE_WEIGHT = 1.0
+TIE_BREAK_PER_DOLLAR = 1e-6
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("Scored recommendations require numpy: pip install numpy") from e
+    return numpy
+
+
+class _Features:
+    # Catalog columns as NumPy views. The code and price arrays are zero-copy views over the
+    # catalog's array buffers; stock is a live view, so set_stock() is seen without re-encoding.
+    def __init__(self, catalog: Catalog):
+        np = _numpy()
+        table = catalog.index.table
+        self.table = table
+        self.codes = {field: np.frombuffer(table.column(field).codes, dtype=np.uint32) for field in INDEXED_FIELDS}
+        self.categories = {
+            field: {value.casefold(): code for code, value in enumerate(table.column(field).categories)}
+            for field in INDEXED_FIELDS
+        }
+        self.prices = np.frombuffer(table.prices, dtype=np.float64)
+        self.log_prices = np.log(np.maximum(self.prices, 0.01)).astype(np.float32)
+        self.stock = np.frombuffer(table.stock, dtype=np.int64)
+        self.tie_break = (self.prices * -TIE_BREAK_PER_DOLLAR).astype(np.float32)
+        self.by_id = catalog.index.by_id
+
+
+class Recommender:
+    """Scores every product against a profile in one vectorized pass and returns the top k.
+
+    score = sum of weights for liked brand/color/style (stated likes plus attributes of past
+    purchases) - PRICE_WEIGHT * |log(price / typical purchase price)|. Out-of-stock, over-budget
+    and already-purchased products are excluded.
+    """
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+        self._features: Optional[_Features] = None
+        self._version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def features(self) -> _Features:
+        if self._features is None or self._version != self.catalog.version:
+            with self._lock:
+                if self._features is None or self._version != self.catalog.version:
+                    version = self.catalog.version
+                    self._features = _Features(self.catalog)
+                    self._version = version
+        return self._features
+
+    def recommend(
+        self,
+        brands: Iterable[str] = (),
+        colors: Iterable[str] = (),
+        styles: Iterable[str] = (),
+        purchased: Iterable[str] = (),
+        max_price: Optional[float] = None,
+        limit: int = 3,
+        stock_of: Optional[Callable[[str], int]] = None,
+    ) -> List[dict]:
+        np = _numpy()
+        features = self.features
+        table = features.table
+        if not len(table):
+            return []
+
+        weights = {field: np.zeros(len(features.categories[field]) or 1, dtype=np.float32) for field in INDEXED_FIELDS}
+        for field, values in (("brand", brands), ("color", colors), ("style", styles)):
+            for value in values:
+                code = features.categories[field].get(str(value).casefold())
+                if code is not None:
+                    weights[field][code] += PROFILE_WEIGHTS[field]
+
+        purchased_positions = [features.by_id[pid] for pid in set(purchased) if pid in features.by_id]
+        if purchased_positions:
+            bought = np.asarray(purchased_positions)
+            for field in INDEXED_FIELDS:
+                np.add.at(weights[field], features.codes[field][bought], HISTORY_WEIGHT)
+
+        # Accumulate into one float32 buffer; every pass below is a single gather or compare.
+        scores = np.take(weights["brand"], features.codes["brand"])
+        for field in ("color", "style"):
+            scores += np.take(weights[field], features.codes[field])
+        # Only rank products that match something the user likes, unless we know nothing yet.
+        eligible = scores > 0 if any(w.any() for w in weights.values()) else np.ones(len(table), dtype=bool)
+        eligible &= features.stock > 0
+        if max_price is not None:
+            eligible &= features.prices <= max_price
+        if purchased_positions:
+            eligible[bought] = False
+        count = int(np.count_nonzero(eligible))
+        if not count:
+            return []
+
+        if purchased_positions:
+            target = np.median(features.log_prices[bought])
+            price_gap = features.log_prices - target
+            np.abs(price_gap, out=price_gap)
+            price_gap *= PRICE_WEIGHT
+            scores -= price_gap
+        # Attribute-only scores take a handful of distinct values, and argpartition slows
+        # down ~10x when the k-th value sits in a huge run of equal keys; a price-ordered
+        # nudge far below the weight scale breaks the runs (cheaper first among equals).
+        ranked = scores + features.tie_break
+
+        # Ranking sparse matches on a compacted copy keeps the -inf run out of argpartition;
+        # dense matches (typical once purchase history is mixed in) are ranked in place.
+        if count < len(table) // 2:
+            positions = np.flatnonzero(eligible)
+            ranked = ranked[positions]
+        else:
+            positions = None
+            ranked[~eligible] = -np.inf
+
+        # Over-fetch so products whose on-hand stock is all held in carts can be dropped
+        # by `stock_of` without a second pass over the catalog.
+        candidates = min(count, limit * 4 if stock_of else limit)
+        top = np.argpartition(ranked, len(ranked) - candidates)[-candidates:]
+        top = top[np.lexsort((top, -ranked[top]))]
+        if positions is not None:
+            top = positions[top]
+        scores = scores[top]
+
+        results = []
+        for pos, score in zip(top.tolist(), scores.tolist()):
+            row = table.row(pos)
+            if stock_of is not None:
+                row["stock"] = stock_of(row["id"])
+                if row["stock"] <= 0:
+                    continue
+            row["score"] = round(score, 3)
+            results.append(row)
+            if len(results) == limit:
+                break
+        return results
@@ -0,0 +1,75 @@
+import re
+import threading
+from typing import Dict, NamedTuple, Optional
+
+
+class RouteDecision(NamedTuple):
+    member: Optional[str]
+    confidence: float
+    scores: Dict[str, float]
+
+
+class RouterStats:
+    """Hit rate and latency bookkeeping for the fast-path router."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.fallbacks = 0
+        self.hit_seconds = 0.0
+        self.fallback_seconds = 0.0
+
+    def record(self, hit: bool, seconds: float) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += seconds
+            else:
+                self.fallbacks += 1
+                self.fallback_seconds += seconds
+
+    def report(self) -> dict:
+        with self._lock:
+            total = self.hits + self.fallbacks
+            avg_hit = self.hit_seconds / self.hits if self.hits else 0.0
+            avg_fallback = self.fallback_seconds / self.fallbacks if self.fallbacks else 0.0
+            # Each hit skips the router model call; until a fallback has been observed
+            # there is no baseline to compare against, so nothing is claimed as saved.
+            saved = self.hits * max(0.0, avg_fallback - avg_hit) if self.fallbacks else 0.0
+            return {
+                "turns": total,
+                "hits": self.hits,
+                "fallbacks": self.fallbacks,
+                "hit_rate": self.hits / total if total else 0.0,
+                "avg_fast_path_s": avg_hit,
+                "avg_fallback_s": avg_fallback,
+                "estimated_saved_s": saved,
+            }
+
+
+class KeywordRouter:
+    """Scores a message against weighted keyword patterns per team member.
+
+    confidence = best / (sum of all scores + prior), so a lone weak keyword or a message
+    that matches several members stays below the threshold and goes to the LLM router.
+    """
+
+    def __init__(self, rules: Dict[str, Dict[str, float]], threshold: float = 0.75, prior: float = 1.0):
+        self.threshold = threshold
+        self.prior = prior
+        self.stats = RouterStats()
+        self._rules = {
+            member: [(re.compile(rf"\b(?:{pattern})\b", re.IGNORECASE), weight) for pattern, weight in patterns.items()]
+            for member, patterns in rules.items()
+        }
+
+    def route(self, message: str) -> RouteDecision:
+        scores = {
+            member: sum(weight for pattern, weight in patterns if pattern.search(message))
+            for member, patterns in self._rules.items()
+        }
+        best = max(scores, key=scores.get)
+        confidence = scores[best] / (sum(scores.values()) + self.prior)
+        if scores[best] > 0 and confidence >= self.threshold:
+            return RouteDecision(best, confidence, scores)
+        return RouteDecision(None, confidence, scores)
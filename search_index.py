@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from catalog import Catalog, tokenize
+from db import writer
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "product_fts"
+FTS_META_TABLE = "product_fts_meta"
+# bm25() column weights for (product_id, name, brand, color, style); product_id is unindexed.
+BM25_WEIGHTS = (0.0, 10.0, 5.0, 3.0, 3.0)
+
+
+def catalog_fingerprint(catalog: Catalog) -> str:
+    # Only the searchable text matters; stock and price changes never require a rebuild.
+    table = catalog.index.table
+    digest = hashlib.blake2b(digest_size=16)
+    for pos in range(len(table)):
+        row = (table.ids[pos], table.names[pos], table.brands[pos], table.colors[pos], table.styles[pos])
+        digest.update("\x1f".join(row).encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+
+class ProductSearchIndex:
+    """FTS5 index over product name, brand, color and style, kept in shopping.db.
+
+    The index records a fingerprint of the catalog text it was built from and is rebuilt
+    whenever the catalog no longer matches, so every worker sharing the database serves
+    the same catalog without re-indexing on every start. If this SQLite build lacks FTS5,
+    `available` is False and callers fall back to the in-memory token index.
+    """
+
+    def __init__(self, engine: Engine, catalog: Catalog, batch_size: int = 10000):
+        self.engine = engine
+        self.catalog = catalog
+        self.batch_size = batch_size
+        self.available: Optional[bool] = None
+        self._synced_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _create(self, conn) -> None:
+        conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "product_id UNINDEXED, name, brand, color, style, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        conn.exec_driver_sql(
+            f"CREATE TABLE IF NOT EXISTS {FTS_META_TABLE} (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+
+    def sync(self, force: bool = False) -> bool:
+        """Make sure the index matches the current catalog; returns True if it was rebuilt."""
+        if self._synced_version == self.catalog.version and not force:
+            return False
+        with self._lock:
+            if self._synced_version == self.catalog.version and not force:
+                return False
+            version = self.catalog.version
+            fingerprint = catalog_fingerprint(self.catalog)
+            try:
+                with writer(self.engine).begin() as conn:
+                    self._create(conn)
+                    stored = conn.exec_driver_sql(
+                        f"SELECT value FROM {FTS_META_TABLE} WHERE key = 'fingerprint'"
+                    ).scalar()
+                    rebuilt = force or stored != fingerprint
+                    if rebuilt:
+                        self._rebuild(conn, fingerprint)
+            except OperationalError as e:
+                if "fts5" not in str(e).lower():
+                    raise
+                logger.warning("SQLite was built without FTS5; product search uses the in-memory index")
+                self.available = False
+                self._synced_version = version
+                return False
+            self.available = True
+            self._synced_version = version
+            return rebuilt
+
+    def _rebuild(self, conn, fingerprint: str) -> None:
+        table = self.catalog.index.table
+        conn.exec_driver_sql(f"DELETE FROM {FTS_TABLE}")
+        insert_sql = f"INSERT INTO {FTS_TABLE} (product_id, name, brand, color, style) VALUES (?, ?, ?, ?, ?)"
+        for start in range(0, len(table), self.batch_size):
+            conn.exec_driver_sql(
+                insert_sql,
+                [
+                    (table.ids[pos], table.names[pos], table.brands[pos], table.colors[pos], table.styles[pos])
+                    for pos in range(start, min(start + self.batch_size, len(table)))
+                ],
+            )
+        conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        conn.exec_driver_sql(
+            f"INSERT INTO {FTS_META_TABLE} (key, value) VALUES ('fingerprint', ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (fingerprint,),
+        )
+
+    def match(self, query: str, limit: int = 200) -> Optional[Dict[str, float]]:
+        """Return {product_id: relevance} for the best `limit` matches, higher is better.
+
+        Every term is a prefix match ("hood" finds "Hoodie"). Products matching all terms
+        are preferred; if none do, any-term matches are ranked by BM25 instead, so filler
+        words like "from" or "the" do not zero out the result. Returns None if FTS5 is
+        unavailable.
+        """
+        self.sync()
+        if not self.available:
+            return None
+        terms = [f'"{token}"*' for token in dict.fromkeys(tokenize(query))]
+        if not terms:
+            return {}
+        weights = ", ".join(str(w) for w in BM25_WEIGHTS)
+        sql = (
+            f"SELECT product_id, bm25({FTS_TABLE}, {weights}) AS rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH ? ORDER BY rank LIMIT ?"
+        )
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql(sql, (" AND ".join(terms), limit)).all()
+            if not rows and len(terms) > 1:
+                rows = conn.exec_driver_sql(sql, (" OR ".join(terms), limit)).all()
+        # bm25() is negative with lower meaning better; flip it so callers can sort descending.
+        return {product_id: -rank for product_id, rank in rows}
@@ -0,0 +1,193 @@
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from agno.memory.v2.db.schema import MemoryRow
+from agno.memory.v2.schema import UserMemory
+
+logger = logging.getLogger(__name__)
+
+SessionKey = Tuple[str, str]
+SLOTS_TOPIC = "shopping_slots"
+
+
+class MemoryDbSlotStore:
+    """Keeps each session's slots as one row in an agno memory db (e.g. memory.db).
+
+    The row's user_id is namespaced per session, so agno never loads it among the user's
+    own memories, and its payload is a UserMemory so code that reads the whole table can
+    still parse it.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def row_id(user_id: str, session_id: str) -> str:
+        return f"{SLOTS_TOPIC}:{user_id}:{session_id}"
+
+    def load(self, user_id: str, session_id: str) -> Dict[str, str]:
+        row_id = self.row_id(user_id, session_id)
+        for row in self.db.read_memories(user_id=row_id, limit=1):
+            return json.loads(row.memory["memory"])
+        return {}
+
+    def save(self, user_id: str, session_id: str, slots: Dict[str, str]) -> None:
+        row_id = self.row_id(user_id, session_id)
+        memory = UserMemory(memory=json.dumps(slots, sort_keys=True), topics=[SLOTS_TOPIC], memory_id=row_id)
+        self.db.upsert_memory(MemoryRow(id=row_id, user_id=row_id, memory=memory.to_dict()))
+
+
+class _SessionSlots:
+    __slots__ = ("store", "values", "dirty", "loaded", "last_used")
+
+    def __init__(self, store: MemoryDbSlotStore):
+        self.store = store
+        # slot -> value; None means "known to be unset" (never stored, or cleared).
+        self.values: Dict[str, Optional[str]] = {}
+        self.dirty: Set[str] = set()
+        self.loaded = False
+        self.last_used = time.monotonic()
+
+
+class SlotCache:
+    """Write-behind cache of shopping-session slots per (user_id, session_id).
+
+    Reads hit the store once per session; writes only mark the slot dirty. Dirty slots
+    reach the store when the turn ends (flush(key)), every `flush_interval`
+    seconds from a daemon thread, or when an idle or least-recently-used session is
+    evicted, so at most `max_sessions` sessions are held.
+    """
+
+    def __init__(self, max_sessions: int = 10000, idle_seconds: float = 1800.0, flush_interval: float = 5.0):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self.flush_interval = flush_interval
+        self._sessions: "OrderedDict[SessionKey, _SessionSlots]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.writes = 0
+        self.flushed = 0
+
+    def _entry(self, key: SessionKey, store: MemoryDbSlotStore) -> _SessionSlots:
+        evicted = []
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                entry = self._sessions[key] = _SessionSlots(store)
+                while len(self._sessions) > self.max_sessions:
+                    evicted.append(self._sessions.popitem(last=False))
+            else:
+                self._sessions.move_to_end(key)
+            entry.last_used = time.monotonic()
+        for old_key, old_entry in evicted:
+            self._write(old_key, old_entry)
+        return entry
+
+    def _load(self, key: SessionKey, entry: _SessionSlots) -> None:
+        if entry.loaded:
+            return
+        stored = entry.store.load(*key)
+        with self._lock:
+            # Slots set while the load was in flight win.
+            for slot, value in stored.items():
+                entry.values.setdefault(slot, value)
+            entry.loaded = True
+
+    def get(self, key: SessionKey, store: MemoryDbSlotStore, slot: str) -> Optional[str]:
+        entry = self._entry(key, store)
+        if slot not in entry.values:
+            self._load(key, entry)
+        return entry.values.get(slot)
+
+    def peek(self, key: SessionKey) -> Dict[str, Optional[str]]:
+        """Slots already cached for a session, without loading anything from the store."""
+        with self._lock:
+            entry = self._sessions.get(key)
+            return dict(entry.values) if entry else {}
+
+    def set(self, key: SessionKey, store: MemoryDbSlotStore, slot: str, value: Optional[str]) -> None:
+        entry = self._entry(key, store)
+        with self._lock:
+            entry.values[slot] = value
+            entry.dirty.add(slot)
+            self.writes += 1
+
+    def set_many(self, key: SessionKey, store: MemoryDbSlotStore, values: Dict[str, Optional[str]]) -> None:
+        entry = self._entry(key, store)
+        with self._lock:
+            entry.values.update(values)
+            entry.dirty.update(values)
+            self.writes += len(values)
+
+    def _write(self, key: SessionKey, entry: _SessionSlots) -> int:
+        with self._lock:
+            pending = set(entry.dirty)
+            entry.dirty.clear()
+        if not pending:
+            return 0
+        user_id, session_id = key
+        try:
+            # The row holds every slot, so slots never read this session must be loaded
+            # before it is rewritten.
+            self._load(key, entry)
+            with self._lock:
+                slots = {slot: value for slot, value in entry.values.items() if value is not None}
+            entry.store.save(user_id, session_id, slots)
+        except Exception:
+            logger.exception("Flushing shopping slots for %s/%s failed; will retry", user_id, session_id)
+            with self._lock:
+                entry.dirty.update(pending)
+                if key not in self._sessions:
+                    self._sessions[key] = entry
+            return 0
+        self.flushed += len(pending)
+        return len(pending)
+
+    def flush(self, key: Optional[SessionKey] = None) -> int:
+        """Write dirty slots for one session, or for every cached session if key is None."""
+        with self._lock:
+            if key is not None:
+                entry = self._sessions.get(key)
+                entries: List[Tuple[Hashable, _SessionSlots]] = [(key, entry)] if entry else []
+            else:
+                entries = list(self._sessions.items())
+        return sum(self._write(k, entry) for k, entry in entries)
+
+    def evict_idle(self) -> int:
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [(key, entry) for key, entry in self._sessions.items() if entry.last_used < cutoff]
+            for key, _ in idle:
+                del self._sessions[key]
+        for key, entry in idle:
+            self._write(key, entry)
+        return len(idle)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="slot-cache-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.evict_idle()
+            except Exception:
+                logger.exception("Slot cache flush failed")
+
+    def __len__(self) -> int:
+        return len(self._sessions)
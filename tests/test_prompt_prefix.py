@@ -0,0 +1,122 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SESSIONS = [
+    ("maya@example.com", "maya_session_1"),
+    ("sam@example.com", "sam_session_7"),
+    ("alex.long-name@example.org", "alex_session_42"),
+]
+# Stored for the first user only, so any memory section in the system prompt makes it differ.
+MEMORIES = {
+    "maya@example.com": ["Wears size 32 jeans", "Prefers deliveries to the office"],
+}
+MESSAGE = "Find me a green hoodie"
+
+
+@pytest.fixture(scope="module")
+def base(tmp_path_factory):
+    # base reads SHOPPING_DB_URL at import and opens memory.db in the working directory.
+    tmp = tmp_path_factory.mktemp("prompt_prefix")
+    cwd = os.getcwd()
+    os.chdir(tmp)
+    os.environ.setdefault("OPENAI_API_KEY", "offline")
+    os.environ["SHOPPING_DB_URL"] = f"sqlite:///{tmp / 'shopping.db'}"
+    import base
+    from agno.memory.v2.schema import UserMemory
+
+    for user_id, memories in MEMORIES.items():
+        for memory in memories:
+            base.get_memory().add_user_memory(UserMemory(memory=memory), user_id=user_id)
+    stable = base.STABLE_PROMPTS
+    yield base
+    base.STABLE_PROMPTS = stable
+    clear_agents(base)
+    base.slot_cache.stop()
+    os.chdir(cwd)
+
+
+def clear_agents(base) -> None:
+    for factory in (base.get_shopping_agent, base.get_user_profile_agent, base.get_coffee_agent, base.get_orchestrator_team):
+        factory.cache_clear()
+
+
+def tool_schemas(target) -> str:
+    from agno.tools.function import Function
+
+    schemas = []
+    for tool in target.tools or []:
+        function = tool.model_copy(deep=True) if isinstance(tool, Function) else Function.from_callable(tool)
+        function.process_entrypoint()
+        schemas.append(function.to_dict())
+    return json.dumps(schemas, sort_keys=True)
+
+
+def render(base, factory, user_id: str, session_id: str):
+    """(tool schemas + system message, user turn) as the provider would receive them."""
+    target = factory()
+    # run() does these before building the prompt: defaults such as agno's memory section
+    # are resolved here, and legacy placeholders render from the session state.
+    if hasattr(target, "initialize_team"):
+        target.initialize_team(session_id=session_id)
+    else:
+        target.initialize_agent()
+    target._initialize_session_state(user_id=user_id, session_id=session_id)
+    system = target.get_system_message(session_id=session_id, user_id=user_id)
+    message = MESSAGE
+    if base.STABLE_PROMPTS:
+        message = base.with_context(message, base.request_context(user_id, session_id))
+    return f"{tool_schemas(target)}\n{system.content if system else ''}", message
+
+
+@pytest.mark.parametrize("target", ["get_shopping_agent", "get_orchestrator_team"])
+def test_stable_layout_shares_the_system_prompt(base, target):
+    base.STABLE_PROMPTS = True
+    clear_agents(base)
+    factory = getattr(base, target)
+    prompts = {session: render(base, factory, *session) for session in SESSIONS}
+
+    assert len({system for system, _ in prompts.values()}) == 1
+    for (user_id, session_id), (system, message) in prompts.items():
+        assert user_id not in system and session_id not in system
+        assert user_id in message and session_id in message
+        for memory in MEMORIES.get(user_id, []):
+            assert memory not in system
+            assert memory in message
+
+
+def test_legacy_layout_keeps_state_in_the_system_prompt(base):
+    base.STABLE_PROMPTS = False
+    clear_agents(base)
+    system, message = render(base, base.get_shopping_agent, *SESSIONS[0])
+    assert SESSIONS[0][0] in system
+    assert all(memory in system for memory in MEMORIES[SESSIONS[0][0]])
+    assert message == MESSAGE
+
+
+def test_replayed_history_drops_the_request_context(base):
+    from agno.models.message import Message
+    from agno.run.response import RunResponse
+
+    from concierge_memory import ConciergeMemory
+    from prompt_layout import with_context
+
+    memory = ConciergeMemory(defer_extraction=False)
+    for n in range(4):
+        context = base.request_context(*SESSIONS[0])
+        memory.add_run(
+            "maya_session_1",
+            RunResponse(
+                run_id=f"run{n}",
+                messages=[
+                    Message(role="user", content=with_context(f"turn {n}", context)),
+                    Message(role="assistant", content="Noted."),
+                ],
+            ),
+        )
+    replayed = memory.get_messages_from_last_n_runs("maya_session_1")
+    assert [m.content for m in replayed if m.role == "user"] == [f"turn {n}" for n in range(4)]
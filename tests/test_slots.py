@@ -0,0 +1,52 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agno.memory.v2.db.sqlite import SqliteMemoryDb
+from agno.memory.v2.memory import Memory
+
+from slots import MemoryDbSlotStore, SlotCache
+
+
+def memory_db(tmp_path):
+    return SqliteMemoryDb(table_name="memory", db_file=str(tmp_path / "memory.db"))
+
+
+def test_slot_round_trips_through_memory_db(tmp_path):
+    store = MemoryDbSlotStore(memory_db(tmp_path))
+    cache = SlotCache()
+    key = ("priya@example.com", "priya_session_1")
+    cache.set(key, store, "product", "Classic Blue Jeans")
+    cache.set(key, store, "size", "32")
+    assert cache.flush(key) == 2
+
+    # A fresh cache (another worker, or after eviction) reads the slots back from the db.
+    fresh = SlotCache()
+    reopened = MemoryDbSlotStore(memory_db(tmp_path))
+    assert fresh.get(key, reopened, "product") == "Classic Blue Jeans"
+    assert fresh.get(key, reopened, "size") == "32"
+    assert fresh.get(key, reopened, "address") is None
+    assert fresh.get(("priya@example.com", "other_session"), reopened, "product") is None
+
+
+def test_partial_write_keeps_slots_not_read_this_session(tmp_path):
+    store = MemoryDbSlotStore(memory_db(tmp_path))
+    key = ("priya@example.com", "priya_session_1")
+    store.save(*key, {"product": "Green Hoodie", "size": "M"})
+    cache = SlotCache()
+    cache.set(key, store, "size", "L")
+    cache.flush(key)
+    assert store.load(*key) == {"product": "Green Hoodie", "size": "L"}
+
+    cache.set_many(key, store, {"product": None, "size": None})
+    cache.flush(key)
+    assert store.load(*key) == {}
+
+
+def test_slot_rows_stay_out_of_user_memories(tmp_path):
+    db = memory_db(tmp_path)
+    MemoryDbSlotStore(db).save("priya@example.com", "priya_session_1", {"product": "Green Hoodie"})
+    memory = Memory(db=db)
+    memory.refresh_from_db()
+    assert memory.get_user_memories("priya@example.com") == []
@@ -0,0 +1,122 @@
+import json
+import re
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Sequence
+
+from agno.tools.function import Function
+
+from history import estimate_tokens
+
+
+class ToolSelection(NamedTuple):
+    groups: FrozenSet[str]
+    tools: List
+    schema_tokens: int
+    saved_tokens: int
+
+
+def _tool_name(tool) -> str:
+    # Tools are @tool Functions or plain callables, which agno wraps itself.
+    return tool.name if isinstance(tool, Function) else tool.__name__
+
+
+def schema_tokens(tool) -> int:
+    """Approximate prompt tokens for one tool's JSON schema as sent to the model."""
+    if isinstance(tool, Function):
+        function = tool.model_copy(deep=True)
+        function.process_entrypoint()
+    else:
+        function = Function.from_callable(tool)
+    return estimate_tokens(json.dumps({"type": "function", "function": function.to_dict()}))
+
+
+class ToolGateStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.turns = 0
+        self.full_tokens = 0
+        self.sent_tokens = 0
+
+    def record(self, selection: ToolSelection) -> None:
+        with self._lock:
+            self.turns += 1
+            self.sent_tokens += selection.schema_tokens
+            self.full_tokens += selection.schema_tokens + selection.saved_tokens
+
+    def report(self) -> dict:
+        with self._lock:
+            saved = self.full_tokens - self.sent_tokens
+            return {
+                "turns": self.turns,
+                "schema_tokens_sent": self.sent_tokens,
+                "schema_tokens_saved": saved,
+                "avg_saved_per_turn": saved / self.turns if self.turns else 0.0,
+            }
+
+
+class ToolGate:
+    """Picks the tool groups an agent needs for one turn.
+
+    A group is exposed when the message matches one of its intent patterns or when the
+    session's slot state calls for it (see `slot_rules`); `always` groups are always sent.
+    If nothing matches, every group is exposed, so gating can narrow a turn but never
+    leave the model without the tool it needs.
+    """
+
+    def __init__(
+        self,
+        groups: Mapping[str, Sequence],
+        intents: Mapping[str, Iterable[str]],
+        always: Iterable[str] = (),
+        slot_rules: Optional[Mapping[str, Iterable[str]]] = None,
+        active_slot: Optional[str] = None,
+    ):
+        self.groups = {name: list(tools) for name, tools in groups.items()}
+        self.always = frozenset(always)
+        self.intents = {
+            name: re.compile(rf"\b(?:{'|'.join(patterns)})\b", re.IGNORECASE) for name, patterns in intents.items()
+        }
+        # slot name -> groups to expose while that slot is filled ("product" -> cart) or,
+        # prefixed with "!", while it is still empty ("!size" -> profile).
+        self.slot_rules = {slot: frozenset(names) for slot, names in (slot_rules or {}).items()}
+        # "!" rules only apply while this slot is filled, e.g. missing size only matters
+        # once there is a product in progress.
+        self.active_slot = active_slot
+        self.stats = ToolGateStats()
+        self._tokens: Dict[str, int] = {}
+
+    def _schema_tokens(self, tools: List) -> int:
+        for tool in tools:
+            if _tool_name(tool) not in self._tokens:
+                self._tokens[_tool_name(tool)] = schema_tokens(tool)
+        return sum(self._tokens[_tool_name(tool)] for tool in tools)
+
+    def tools_for(self, names: Optional[Iterable[str]] = None) -> List:
+        """Tools of the given groups (all groups if None), deduplicated, in declaration order."""
+        names = set(self.groups) if names is None else set(names)
+        tools, seen = [], set()
+        for name, group in self.groups.items():
+            if name in names:
+                for tool in group:
+                    if _tool_name(tool) not in seen:
+                        seen.add(_tool_name(tool))
+                        tools.append(tool)
+        return tools
+
+    def select(self, message: str, slots: Optional[Mapping[str, Optional[str]]] = None) -> ToolSelection:
+        selected = set(name for name, pattern in self.intents.items() if pattern.search(message))
+        slots = slots or {}
+        active = self.active_slot is None or bool(slots.get(self.active_slot))
+        for rule, names in self.slot_rules.items():
+            filled = bool(slots.get(rule.lstrip("!")))
+            if (not filled and active) if rule.startswith("!") else filled:
+                selected |= names
+        if not selected:
+            selected = set(self.groups)
+        selected = frozenset(selected | self.always)
+        tools = self.tools_for(selected)
+        full = self._schema_tokens(self.tools_for())
+        sent = self._schema_tokens(tools)
+        selection = ToolSelection(selected, tools, sent, max(0, full - sent))
+        self.stats.record(selection)
+        return selection